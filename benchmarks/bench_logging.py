@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Caller-side cost of a log call: synchronous handler vs. QueuedLogging.
+
+The sink is a stream whose write() sleeps, standing in for a container log
+driver under pressure. Reports the mean time logger.info() holds the
+calling thread (the event loop, in the app) and what the queued pipeline
+did with the records.
+
+Run from the repository root: python benchmarks/bench_logging.py
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_queue import QueuedLogging  # noqa: E402
+
+N = 2000
+
+
+class SlowStream:
+    """Write target that takes `delay` seconds per write"""
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def caller_time(logger: logging.Logger) -> float:
+    start = time.perf_counter()
+    for i in range(N):
+        logger.info(f"Viewing message {i}")
+    return (time.perf_counter() - start) / N
+
+
+def make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def main():
+    print(f"{'sink delay':>10}  {'sync':>10}  {'queued':>10}  queued pipeline stats")
+    for delay in (0.0, 0.0001, 0.001):
+        sync = make_logger(f"bench.sync.{delay}", logging.StreamHandler(SlowStream(delay)))
+        pipeline = QueuedLogging(logging.StreamHandler(SlowStream(delay)), queue_size=1000, rate_limit=0)
+        pipeline.start()
+        queued = make_logger(f"bench.queued.{delay}", pipeline.handler)
+        before, after = caller_time(sync), caller_time(queued)
+        pipeline.stop()
+        print(f"{delay * 1e3:>7.1f} ms  {before * 1e6:>7.1f} us  {after * 1e6:>7.1f} us  {pipeline.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Recording and scrape cost of the metrics in metrics.py.
+
+Times one histogram observation and one counter increment (what a request
+or a database operation adds), and a full render of a registry sized like
+the app's after some traffic.
+
+Run from the repository root: python benchmarks/bench_metrics.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metrics import MetricsRegistry  # noqa: E402
+
+ROUTES = ["/", "/view", "/api/create", "/api/create-binary", "/api/view", "/api/view-binary",
+          "/api/update", "/api/list-pending-secrets", "/api/list-secrets",
+          "/api/update-custom-name", "/api/delete-secret", "/health", "/metrics"]
+STATUSES = ["200", "400", "403", "404", "410", "422"]
+
+
+def bench(func, number: int = 200000) -> float:
+    """Best-of-5 mean seconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("bench_request_duration_seconds", "Request latency",
+                                   ("method", "route", "status"))
+    counter = registry.counter("bench_rows_changed", "Rows changed", ("operation",))
+    for route in ROUTES:
+        for status in STATUSES:
+            histogram.observe(0.003, "POST", route, status)
+
+    print(f"histogram observe  {bench(lambda: histogram.observe(0.0042, 'POST', '/api/view', '200')) * 1e9:>8.0f} ns")
+    print(f"counter inc        {bench(lambda: counter.inc('write_batch', amount=3)) * 1e9:>8.0f} ns")
+    text = registry.render()
+    render = bench(registry.render, number=200)
+    print(f"render             {render * 1e6:>8.0f} us  ({len(text.splitlines())} lines, {len(text)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
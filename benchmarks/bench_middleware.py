@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Per-request cost of the request-id + security-headers middleware.
+
+Drives a bare Starlette app directly over ASGI (no server, no sockets) and
+compares the previous @app.middleware("http") version, built on
+BaseHTTPMiddleware with per-header assignment, against the pure ASGI
+RequestContextMiddleware. Both wrap the same JSON endpoint and a 1 MB
+streaming endpoint.
+
+Run from the repository root: python benchmarks/bench_middleware.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="inigma-bench-"))
+os.symlink(os.path.join(ROOT, "templates-modular"), "templates-modular")
+logging.disable(logging.CRITICAL)
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+import main  # noqa: E402
+
+
+async def base_http_middleware(request, call_next):
+    """The middleware as it was before RequestContextMiddleware"""
+    request_id = uuid.uuid4().hex[:16]
+    token = main.request_id_var.set(request_id)
+    try:
+        main.logger.info("Incoming request")
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        if "content-security-policy" not in response.headers:
+            response.headers["Content-Security-Policy"] = "default-src 'none'; frame-ancestors 'none'"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        response.headers["Permissions-Policy"] = "camera=(), microphone=(), geolocation=(), payment=()"
+        return response
+    finally:
+        main.request_id_var.reset(token)
+
+
+async def health(request):
+    return JSONResponse({"status": "healthy"})
+
+
+async def stream(request):
+    async def chunks():
+        for _ in range(16):
+            yield b"\0" * 65536
+    return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+
+ROUTES = [Route("/health", health), Route("/stream", stream)]
+APPS = {
+    "BaseHTTPMiddleware": Starlette(routes=ROUTES, middleware=[
+        Middleware(BaseHTTPMiddleware, dispatch=base_http_middleware)]),
+    "pure ASGI": Starlette(routes=ROUTES, middleware=[Middleware(main.RequestContextMiddleware)]),
+}
+
+
+async def request(app, path: str) -> int:
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1),
+             "server": ("bench", 80)}
+    body = 0
+    received = False
+
+    async def receive():
+        # Like a server: the request body once, then wait for a disconnect
+        # that never comes (StreamingResponse cancels the wait when done)
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()
+        received = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal body
+        if message["type"] == "http.response.body":
+            body += len(message.get("body", b""))
+    await app(scope, receive, send)
+    return body
+
+
+async def bench(app, path: str, number: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            await request(app, path)
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+async def run():
+    print(f"{'endpoint':<10}  " + "  ".join(f"{name:>18}" for name in APPS))
+    for path, number in (("/health", 5000), ("/stream", 500)):
+        timings = [await bench(app, path, number) for app in APPS.values()]
+        print(f"{path:<10}  " + "  ".join(f"{t * 1e6:>15.1f} us" for t in timings))
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""Request body parsing cost for each JSON endpoint.
+
+Parses a representative body the way FastAPI does (json.loads, then model
+validation) with the previous request models, where every id, uid, IV and
+salt went through a Python field_validator, and with main.py's current
+models, whose constraints are annotated types checked inside pydantic-core.
+main.py is imported from a scratch directory so its database is not
+created in the repository.
+
+Run from the repository root: python benchmarks/bench_request_models.py
+"""
+import base64
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import timeit
+from typing import Optional, Union
+
+from pydantic import BaseModel, field_validator
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="inigma-bench-"))
+os.symlink(os.path.join(ROOT, "templates-modular"), "templates-modular")
+logging.disable(logging.CRITICAL)
+
+import main  # noqa: E402
+import validation  # noqa: E402
+
+UID_REGEX = re.compile(r'^[a-zA-Z0-9_-]{1,128}$')
+
+
+# The request models as they were before validation.py's annotated types
+def _check_view(v: str) -> str:
+    if not isinstance(v, str) or not re.match(r'^[a-zA-Z0-9_-]{1,50}$', v):
+        raise ValueError('Invalid message ID format')
+    return v
+
+
+def _check_uid(v: str) -> str:
+    if not v or not UID_REGEX.match(v):
+        raise ValueError('Invalid UID format')
+    return v
+
+
+def _check_iv(v: str) -> Union[bytes, str]:
+    if not v or len(v) > validation.MAX_IV_LENGTH:
+        raise ValueError('Invalid IV length')
+    try:
+        return validation.decode_base64(v)
+    except ValueError:
+        raise ValueError('Invalid IV format') from None
+
+
+def _check_salt(v: str) -> Union[bytes, str]:
+    if not v or len(v) > validation.MAX_SALT_LENGTH:
+        raise ValueError('Invalid salt length')
+    try:
+        return validation.decode_base64(v)
+    except ValueError:
+        raise ValueError('Invalid salt format') from None
+
+class BaselineCreateMessageRequest(BaseModel):
+    iv: str
+    salt: str
+    ttl: Optional[int] = 30
+    custom_name: Optional[str] = ""
+    creator_uid: str
+    idempotency_key: Optional[str] = None
+    encrypted_message: str
+
+    @field_validator('idempotency_key')
+    @classmethod
+    def validate_idempotency_key(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None and (len(v) > 64 or not re.match(r'^[a-zA-Z0-9_-]+$', v)):
+            raise ValueError('Invalid idempotency key format')
+        return v
+
+    @field_validator('ttl')
+    @classmethod
+    def validate_ttl(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and (v < 0 or v > 365):
+            raise ValueError('TTL must be between 0 and 365 days')
+        return v
+
+    @field_validator('iv')
+    @classmethod
+    def validate_iv(cls, v: str) -> Union[bytes, str]:
+        return _check_iv(v)
+
+    @field_validator('salt')
+    @classmethod
+    def validate_salt(cls, v: str) -> Union[bytes, str]:
+        return _check_salt(v)
+
+    @field_validator('creator_uid')
+    @classmethod
+    def validate_creator_uid(cls, v: str) -> str:
+        return _check_uid(v)
+
+    @field_validator('custom_name')
+    @classmethod
+    def validate_custom_name(cls, v: str) -> str:
+        return main.sanitize_custom_name(v or "")
+
+    @field_validator('encrypted_message')
+    @classmethod
+    def validate_ciphertext(cls, v: str) -> Union[bytes, str]:
+        return validation.validate_ciphertext(v)
+
+
+class BaselineUpdateOwnerRequest(BaseModel):
+    view: str
+    uid: str
+    encrypted_message: str
+    iv: str
+    salt: str
+
+    @field_validator('view')
+    @classmethod
+    def validate_view(cls, v: str) -> str:
+        return _check_view(v)
+
+    @field_validator('uid')
+    @classmethod
+    def validate_uid(cls, v: str) -> str:
+        return _check_uid(v)
+
+    @field_validator('encrypted_message')
+    @classmethod
+    def validate_ciphertext(cls, v: str) -> Union[bytes, str]:
+        return validation.validate_ciphertext(v)
+
+    @field_validator('iv')
+    @classmethod
+    def validate_iv(cls, v: str) -> Union[bytes, str]:
+        return _check_iv(v)
+
+    @field_validator('salt')
+    @classmethod
+    def validate_salt(cls, v: str) -> Union[bytes, str]:
+        return _check_salt(v)
+
+
+class BaselineViewMessageRequest(BaseModel):
+    view: str
+    uid: str
+
+    @field_validator('view')
+    @classmethod
+    def validate_view(cls, v: str) -> str:
+        return _check_view(v)
+
+    @field_validator('uid')
+    @classmethod
+    def validate_uid(cls, v: str) -> str:
+        return _check_uid(v)
+
+
+class BaselineListSecretsRequest(BaseModel):
+    uid: str
+    page: int = 1
+    per_page: int = 10
+    cursor: Optional[str] = None
+    include_total: bool = True
+
+    @field_validator('cursor')
+    @classmethod
+    def validate_cursor(cls, v: Optional[str]) -> Optional[str]:
+        if v:
+            if len(v) > 128:
+                raise ValueError('Invalid cursor')
+            main.decode_cursor(v)
+        return v
+
+    @field_validator('page')
+    @classmethod
+    def validate_page(cls, v: int) -> int:
+        if v < 1:
+            raise ValueError('Page must be >= 1')
+        return v
+
+    @field_validator('per_page')
+    @classmethod
+    def validate_per_page(cls, v: int) -> int:
+        if v < 1 or v > 100:
+            raise ValueError('Per page must be between 1 and 100')
+        return v
+
+    @field_validator('uid')
+    @classmethod
+    def validate_uid(cls, v: str) -> str:
+        return _check_uid(v)
+
+
+class BaselineUpdateCustomNameRequest(BaseModel):
+    view: str
+    uid: str
+    custom_name: str
+
+    @field_validator('view')
+    @classmethod
+    def validate_view(cls, v: str) -> str:
+        return _check_view(v)
+
+    @field_validator('uid')
+    @classmethod
+    def validate_uid(cls, v: str) -> str:
+        return _check_uid(v)
+
+    @field_validator('custom_name')
+    @classmethod
+    def validate_custom_name(cls, v: str) -> str:
+        return main.sanitize_custom_name(v or "")
+
+
+class BaselineDeleteSecretRequest(BaseModel):
+    view: str
+    uid: str
+
+    @field_validator('view')
+    @classmethod
+    def validate_view(cls, v: str) -> str:
+        return _check_view(v)
+
+    @field_validator('uid')
+    @classmethod
+    def validate_uid(cls, v: str) -> str:
+        return _check_uid(v)
+
+
+UID = "u_" + "a1B2-c3" * 8
+VIEW = "Xy3_9-kLmNoPqRsTuVwXyZ012"
+IV = base64.b64encode(os.urandom(12)).decode()
+SALT = base64.b64encode(os.urandom(16)).decode()
+CIPHERTEXT = base64.b64encode(os.urandom(768)).decode()  # 1 KB of base64
+
+ENDPOINTS = {
+    "/api/create": (BaselineCreateMessageRequest, main.CreateMessageRequest, {
+        "encrypted_message": CIPHERTEXT, "iv": IV, "salt": SALT, "ttl": 7,
+        "custom_name": "Deploy key", "creator_uid": UID, "idempotency_key": "req-1234",
+    }),
+    "/api/update": (BaselineUpdateOwnerRequest, main.UpdateOwnerRequest, {
+        "view": VIEW, "uid": UID, "encrypted_message": CIPHERTEXT, "iv": IV, "salt": SALT,
+    }),
+    "/api/view": (BaselineViewMessageRequest, main.ViewMessageRequest, {"view": VIEW, "uid": UID}),
+    "/api/list-secrets": (BaselineListSecretsRequest, main.ListSecretsRequest, {"uid": UID, "page": 2, "per_page": 25}),
+    "/api/update-custom-name": (BaselineUpdateCustomNameRequest, main.UpdateCustomNameRequest, {
+        "view": VIEW, "uid": UID, "custom_name": "Renamed secret",
+    }),
+    "/api/delete-secret": (BaselineDeleteSecretRequest, main.DeleteSecretRequest, {"view": VIEW, "uid": UID}),
+}
+
+
+def bench(models, body: bytes, number: int = 20000, repeat: int = 7):
+    """Best mean seconds per parse for each model, runs interleaved so
+    both see the same machine noise"""
+    timers = []
+    for model in models:
+        model.model_validate(json.loads(body))  # must be a valid request
+        timers.append(timeit.Timer(lambda model=model: model.model_validate(json.loads(body))))
+    best = [float("inf")] * len(models)
+    for _ in range(repeat):
+        for i, timer in enumerate(timers):
+            best[i] = min(best[i], timer.timeit(number))
+    return [seconds / number for seconds in best]
+
+
+def main_():
+    print(f"{'endpoint':<24}  {'validators':>13}  {'annotated':>13}  {'speedup':>7}")
+    for endpoint, (baseline, model, payload) in ENDPOINTS.items():
+        before, after = bench((baseline, model), json.dumps(payload).encode())
+        print(f"{endpoint:<24}  {before * 1e6:>10.2f} us  {after * 1e6:>10.2f} us  {before / after:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Serialization cost of the largest JSON responses.
+
+Compares FastAPI's path for a handler that returns a plain dict
+(jsonable_encoder, then the stdlib json encoder in JSONResponse) with
+TypedJSONResponse, which hands the dict to the declared schema's
+compiled serializer. Also compares the stdlib and fast encoders on a log
+entry as built by JSONFormatter.
+
+Run from the repository root: python benchmarks/bench_responses.py
+"""
+import base64
+import json
+import logging
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="inigma-bench-"))
+os.symlink(os.path.join(ROOT, "templates-modular"), "templates-modular")
+logging.disable(logging.CRITICAL)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import main  # noqa: E402
+from serialization import JSON_ENCODER, TypedJSONResponse, json_dumps  # noqa: E402
+
+
+def view_body(size: int) -> dict:
+    return {
+        "encrypted_message": base64.b64encode(os.urandom(size * 3 // 4)).decode(),
+        "iv": base64.b64encode(os.urandom(12)).decode(),
+        "salt": base64.b64encode(os.urandom(16)).decode(),
+        "custom_name": "Deploy key",
+        "is_owner": False,
+    }
+
+
+def list_body(items: int) -> dict:
+    return {
+        "secrets": [{
+            "id": f"Xy3_9-kLmNoPqRsTuVwXy{i:04d}",
+            "custom_name": f"Secret number {i}",
+            "days_remaining": i % 30,
+            "time_remaining_display": f"{i % 30} days",
+            "time_remaining_type": "days",
+        } for i in range(items)],
+        "per_page": items, "page": 1, "total": 1000, "has_more": True, "next_cursor": None,
+    }
+
+
+CASES = [
+    ("view 1 KB", main.VIEW_RESPONSE, view_body(1024)),
+    ("view 2 MB", main.VIEW_RESPONSE, view_body(2 * 1024 * 1024)),
+    ("list 10 items", main.SECRET_LIST_RESPONSE, list_body(10)),
+    ("list 100 items", main.SECRET_LIST_RESPONSE, list_body(100)),
+]
+
+
+def bench(func, number: int) -> float:
+    """Best-of-5 mean seconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main_():
+    print(f"fast encoder: {JSON_ENCODER}")
+    print(f"{'response':<16}  {'dict + stdlib':>14}  {'typed schema':>13}  {'speedup':>7}")
+    for label, schema, body in CASES:
+        assert JSONResponse(jsonable_encoder(body)).body == TypedJSONResponse(schema, body).body
+        number = 20 if "MB" in label else 2000
+        before = bench(lambda: JSONResponse(jsonable_encoder(body)), number)
+        after = bench(lambda: TypedJSONResponse(schema, body), number)
+        print(f"{label:<16}  {before * 1e6:>11.1f} us  {after * 1e6:>10.1f} us  {before / after:>6.1f}x")
+
+    entry = {
+        "timestamp": "2026-10-17 12:00:00,000", "level": "info", "logger": "main",
+        "message": "Viewing message Xy3_9-kLmNoPqRsTuVwXyZ012",
+        "requestId": "3f2b8c1e-0a4d-4e55-9b1c-2d7e6f8a9b0c",
+    }
+    before = bench(lambda: json.dumps(entry, ensure_ascii=False), 20000)
+    after = bench(lambda: json_dumps(entry).decode("utf-8"), 20000)
+    print(f"{'log entry':<16}  {before * 1e6:>11.1f} us  {after * 1e6:>10.1f} us  {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Per-request cost of validating and decoding an encrypted_message field.
+
+Compares the previous path (Python-level BASE64_REGEX scan in the request
+validator, then a second base64 decode plus canonical check in
+b64_to_blob) with validation.validate_ciphertext, which does both in one
+strict binascii pass.
+
+Run from the repository root: python benchmarks/bench_validation.py
+"""
+import base64
+import binascii
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from validation import validate_ciphertext  # noqa: E402
+
+BASE64_REGEX = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+SIZES = {"1 KB": 1024, "100 KB": 100 * 1024, "2 MB": 2 * 1024 * 1024}
+
+
+def regex_then_decode(value: str):
+    """Validation + storage decode as done before validation.py"""
+    if not value or len(value) > 2 * 1024 * 1024:
+        raise ValueError("bad length")
+    if not BASE64_REGEX.match(value):
+        raise ValueError("Invalid base64 format")
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return value
+    tail = len(raw) % 3
+    if tail and base64.b64encode(raw[-tail:]).decode("ascii") != value[-4:]:
+        return value
+    return raw
+
+
+def bench(func, value: str) -> float:
+    """Best-of-5 mean seconds per call"""
+    number = max(1, 2_000_000 // len(value))
+    return min(timeit.repeat(lambda: func(value), number=number, repeat=5)) / number
+
+
+def main():
+    print(f"{'payload':>8}  {'regex + decode':>15}  {'strict binascii':>15}  {'speedup':>7}")
+    for label, size in SIZES.items():
+        # base64 text of exactly `size` characters (size is a multiple of 4)
+        value = base64.b64encode(os.urandom(size * 3 // 4)).decode("ascii")
+        assert regex_then_decode(value) == validate_ciphertext(value)
+        before = bench(regex_then_decode, value)
+        after = bench(validate_ciphertext, value)
+        print(f"{label:>8}  {before * 1e6:>12.1f} us  {after * 1e6:>12.1f} us  {before / after:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,72 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
+import base64
+import contextvars
+import functools
+import hashlib
+import math
+import os
+import queue
+import random
+import re
 import sqlite3
 import logging
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional, Dict, Any, List, Tuple, TypeVar, Union
 from contextlib import contextmanager
 
+from validation import decode_base64
+
 logger = logging.getLogger(__name__)
 
 PERMANENT_TTL = 9999999999
 
+# Ciphertext of expiring messages is partitioned into one table per UTC day
+# of expiry (message_payloads_<day>); permanent ones stay in message_payloads
+PAYLOAD_TABLE = "message_payloads"
+PARTITION_SECONDS = 24 * 60 * 60
+PARTITION_TABLE_REGEX = re.compile(r'^message_payloads_(\d+)$')
+
+T = TypeVar("T")
+
+CURSOR_ID_REGEX = re.compile(r'^[a-zA-Z0-9_-]{1,50}$')
+
+# Keep user_counters in step with messages (see DatabaseManager._init_counters).
+# A row counts as "owned" by uid once claimed, and as "pending" for its
+# creator_uid while uid is still empty.
+_COUNTER_ADD = """
+    INSERT INTO user_counters (uid, owned) SELECT {row}.uid, 1 WHERE {row}.uid != ''
+    ON CONFLICT(uid) DO UPDATE SET owned = owned + 1;
+    INSERT INTO user_counters (uid, pending) SELECT {row}.creator_uid, 1
+    WHERE {row}.uid = '' AND {row}.creator_uid != ''
+    ON CONFLICT(uid) DO UPDATE SET pending = pending + 1;
+"""
+_COUNTER_REMOVE = """
+    UPDATE user_counters SET owned = owned - 1 WHERE {row}.uid != '' AND uid = {row}.uid;
+    UPDATE user_counters SET pending = pending - 1
+    WHERE {row}.uid = '' AND {row}.creator_uid != '' AND uid = {row}.creator_uid;
+"""
+COUNTER_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_messages_counters_insert AFTER INSERT ON messages
+    BEGIN {_COUNTER_ADD.format(row="NEW")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_messages_counters_delete AFTER DELETE ON messages
+    BEGIN {_COUNTER_REMOVE.format(row="OLD")} END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_messages_counters_update AFTER UPDATE OF uid, creator_uid ON messages
+    WHEN OLD.uid IS NOT NEW.uid OR OLD.creator_uid IS NOT NEW.creator_uid
+    BEGIN {_COUNTER_REMOVE.format(row="OLD")} {_COUNTER_ADD.format(row="NEW")} END
+    """,
+)
+
 def calculate_time_remaining(ttl: int, current_time: int) -> Dict[str, Any]:
     """
     Calculate time remaining for a secret with smart formatting
@@ -53,34 +110,451 @@ def calculate_time_remaining(ttl: int, current_time: int) -> Dict[str, Any]:
             "type": "minutes"
         }
 
+def b64_to_blob(value: Union[bytes, str]) -> Union[bytes, str]:
+    """Decode base64 text to raw bytes for BLOB storage.
+
+    Only canonical base64 is converted, so blob_to_b64 always gives back
+    exactly what the client sent; anything else is stored verbatim. Bytes
+    (already decoded during request validation) pass straight through.
+    """
+    if isinstance(value, bytes):
+        return value
+    try:
+        return decode_base64(value)
+    except ValueError:
+        return value
+
+
+def blob_to_b64(value: Union[bytes, str]) -> str:
+    """Re-encode a stored BLOB as base64 text (inverse of b64_to_blob)"""
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+
+class PayloadChangedError(Exception):
+    """A message was claimed, re-encrypted or deleted while its payload was being streamed"""
+
+
+class MigrationRequiredError(Exception):
+    """The database needs `python -m database migrate` before the app can use it"""
+
+
+def is_busy_error(error: sqlite3.Error) -> bool:
+    """True if ``error`` is SQLITE_BUSY/SQLITE_LOCKED (lock contention, safe to retry)"""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+def payload_partition(ttl: int) -> str:
+    """Name of the payload table holding the ciphertext of a message with this TTL"""
+    if ttl == PERMANENT_TTL:
+        return PAYLOAD_TABLE
+    return f"{PAYLOAD_TABLE}_{ttl // PARTITION_SECONDS}"
+
+
+def encode_cursor(created_at: int, message_id: str) -> str:
+    """Encode a keyset position as an opaque pagination cursor"""
+    raw = f"{created_at}:{message_id}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Decode a pagination cursor into (created_at, id); raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        created_at, message_id = raw.split(":", 1)
+        position = (int(created_at), message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not CURSOR_ID_REGEX.match(message_id):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    Connections are configured once (WAL, busy_timeout, row factory) and
+    handed out LIFO so the most recently used one — with the warmest page
+    cache — is reused first. Connections idle longer than
+    ``health_check_interval`` are pinged before being handed out again.
+    """
+
+    def __init__(self, db_path: Path, max_size: int = 8, timeout: float = 10.0,
+                 health_check_interval: float = 30.0, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.health_check_interval = health_check_interval
+        self._idle: "queue.LifoQueue[Tuple[sqlite3.Connection, float]]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._stats = {
+            "created": 0,
+            "borrowed": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "discarded": 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False: a connection may be borrowed by different
+        # threads over its lifetime, but only by one at a time.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def acquire(self) -> sqlite3.Connection:
+        """Borrow a connection, opening a new one if the pool is not full"""
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_grow = self._size < self.max_size
+                if can_grow:
+                    self._size += 1
+            if can_grow:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+                self._count("borrowed")
+                return conn
+
+            self._count("waits")
+            try:
+                conn, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                self._count("timeouts")
+                raise sqlite3.OperationalError("connection pool exhausted")
+
+        if time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+            logger.warning("Discarding unhealthy pooled database connection")
+            self._count("health_check_failures")
+            self._close_quietly(conn)
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+
+        self._count("borrowed")
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        """Return a connection to the pool (or close it if it is unusable)"""
+        if not discard and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        if discard:
+            self._close_quietly(conn)
+            with self._lock:
+                self._size -= 1
+                self._stats["discarded"] += 1
+            return
+
+        self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(conn)
+            with self._lock:
+                self._size -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of pool counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["size"] - stats["idle"]
+        stats["max_size"] = self.max_size
+        return stats
+
+    @staticmethod
+    def _close_quietly(conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+class MessageCache:
+    """Read-through LRU cache of retrieve_message results.
+
+    Bounded by ``max_bytes``, with each entry weighted by its ciphertext,
+    IV and salt sizes. Entries whose TTL has passed are dropped on lookup
+    instead of being served. Writers call ``invalidate`` after commit; a
+    global generation counter keeps a reader that loaded a row before the
+    invalidation from putting the old version back.
+    """
+
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def _weight(self, message: Dict[str, Any]) -> int:
+        return self.ENTRY_OVERHEAD + sum(
+            len(message[key] or b"") for key in ("encrypted_message", "iv", "salt")
+        )
+
+    def _remove(self, message_id: str):
+        _, weight = self._entries.pop(message_id)
+        self._bytes -= weight
+
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Cached message (a copy), or None on a miss or if it has expired"""
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is not None and entry[0]['ttl'] < int(time.time()):
+                self._remove(message_id)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(message_id)
+            self._stats["hits"] += 1
+            return dict(entry[0])
+
+    def put(self, message_id: str, message: Dict[str, Any], generation: int):
+        """Cache a message loaded while the cache was at ``generation``"""
+        weight = self._weight(message)
+        if weight > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return  # an invalidation raced with the load
+            if message_id in self._entries:
+                self._remove(message_id)
+            self._entries[message_id] = (dict(message), weight)
+            self._bytes += weight
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_weight) = self._entries.popitem(last=False)
+                self._bytes -= evicted_weight
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *message_ids: str):
+        """Forget messages that were just changed or deleted"""
+        with self._lock:
+            self._generation += 1
+            for message_id in message_ids:
+                if message_id in self._entries:
+                    self._remove(message_id)
+                    self._stats["invalidations"] += 1
+
+    def purge_expired(self):
+        """Drop every entry whose TTL has passed"""
+        now = int(time.time())
+        with self._lock:
+            for message_id in [k for k, (m, _) in self._entries.items() if m['ttl'] < now]:
+                self._remove(message_id)
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class MessageIdFilter:
+    """Counting Bloom filter over live message ids.
+
+    ``might_contain`` is never False for an id that was added and not
+    removed, so False is a definite miss that needs no database lookup.
+    One byte counter per slot makes removal possible; a counter that
+    saturates at 255 is never decremented again, which can only cost
+    extra false positives.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._counters = bytearray(self.size)
+
+    def _slots(self, message_id: str):
+        digest = hashlib.blake2b(message_id.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, message_id: str):
+        for slot in self._slots(message_id):
+            if self._counters[slot] < 255:
+                self._counters[slot] += 1
+        self.count += 1
+
+    def remove(self, message_id: str):
+        for slot in self._slots(message_id):
+            if 0 < self._counters[slot] < 255:
+                self._counters[slot] -= 1
+        self.count = max(0, self.count - 1)
+
+    def might_contain(self, message_id: str) -> bool:
+        return all(self._counters[slot] for slot in self._slots(message_id))
+
+    def estimated_fp_rate(self) -> float:
+        """Expected false-positive rate at the current fill"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._counters)
+
+
 class DatabaseManager:
     """SQLite database manager for Inigma messages"""
     
-    def __init__(self, db_path: str = "data/inigma.db"):
+    def __init__(self, db_path: str = "data/inigma.db", pool_size: int = 8,
+                 busy_timeout_ms: int = 1000, busy_retries: int = 5,
+                 busy_backoff: float = 0.01, busy_backoff_max: float = 0.5,
+                 cache_bytes: int = 32 * 1024 * 1024,
+                 id_filter_capacity: int = 100000, id_filter_fp_rate: float = 0.01,
+                 query_observer: Optional[Callable[[str, float, int], None]] = None,
+                 run_migrations: bool = False):
         self.db_path = Path(db_path)
         # Create the data directory if it does not exist
         self.db_path.parent.mkdir(exist_ok=True)
+        self.pool = ConnectionPool(self.db_path, max_size=pool_size, busy_timeout_ms=busy_timeout_ms)
+        self.cache = MessageCache(cache_bytes)
+        # Negative-lookup filter over message ids (see MessageIdFilter)
+        self.id_filter_capacity = id_filter_capacity
+        self.id_filter_fp_rate = id_filter_fp_rate
+        self.id_filter = MessageIdFilter(id_filter_capacity, id_filter_fp_rate)
+        self._id_filter_lock = threading.Lock()
+        self._id_filter_log: Optional[List[str]] = None
+        self._id_filter_stats = {"checks": 0, "definite_misses": 0, "rebuilds": 0}
+        # Write transactions retry SQLITE_BUSY themselves (see _write), so the
+        # per-attempt busy_timeout can stay short
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self.busy_backoff_max = busy_backoff_max
+        self._lock_stats_lock = threading.Lock()
+        self._lock_stats = {
+            "transactions": 0,
+            "busy_retries": 0,
+            "busy_failures": 0,
+            "lock_wait_seconds_total": 0.0,
+            "lock_wait_max_seconds": 0.0,
+            "backoff_seconds_total": 0.0,
+        }
+        # Names of existing payload partition tables (see payload_partition)
+        self._partitions: set = set()
+        self._partitions_lock = threading.Lock()
+        # (table, columns) still to scan for base64 TEXT left by older
+        # versions, and the last id scanned in the first one; None until
+        # the first convert_legacy_base64 call
+        self._legacy_tables: Optional[List[Tuple[str, Tuple[str, ...]]]] = None
+        self._legacy_after_id = ""
+        # Ids of streamed uploads whose payload row has no metadata row yet
+        self._uploads: set = set()
+        self._uploads_lock = threading.Lock()
+        # Called as (operation, seconds, rows_changed) for every borrowed connection
+        self.query_observer = query_observer
+        # Slow one-time conversions of existing databases run only when asked
+        # (python -m database migrate), never on the app's startup path
+        self.run_migrations = run_migrations
         self.init_database()
+        self.rebuild_id_filter()
     
     def init_database(self):
         """Initialize database with required tables"""
-        with self.get_connection() as conn:
+        with self.get_connection("init_database") as conn:
             cursor = conn.cursor()
+            new_database = conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is None
+            if new_database or self.run_migrations:
+                self._enable_incremental_vacuum(conn)
+            elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.warning(
+                    "auto_vacuum is not INCREMENTAL, so freed pages are not returned to the "
+                    "filesystem; run `python -m database migrate` to convert the database"
+                )
             
-            # Create messages table
+            # Create messages table (metadata only — ciphertext lives in
+            # message_payloads so large secrets never bloat metadata pages)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS messages (
                     id TEXT PRIMARY KEY,
                     ttl INTEGER NOT NULL,
                     uid TEXT NOT NULL DEFAULT '',
-                    encrypted_message TEXT NOT NULL,
-                    iv TEXT NOT NULL,
-                    salt TEXT NOT NULL,
+                    iv BLOB NOT NULL,
+                    salt BLOB NOT NULL,
                     custom_name TEXT DEFAULT '',
                     creator_uid TEXT DEFAULT '',
-                    created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+                    created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+                    payload_size INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+            # Ciphertext store, keyed by message id
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS message_payloads (
+                    id TEXT PRIMARY KEY,
+                    encrypted_message BLOB NOT NULL
                 )
             """)
+            self._load_partitions(conn)
+            if self.run_migrations:
+                self._migrate_inline_payloads(conn)
+                self._migrate_payload_partitions(conn)
+            else:
+                self._require_migrated(conn)
+
+            # Permanent payloads go away with their message; partitioned ones
+            # are deleted by delete_message or dropped with their expiry day
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_messages_payload_delete AFTER DELETE ON messages
+                BEGIN
+                    DELETE FROM message_payloads WHERE id = OLD.id;
+                END
+            """)
             
             # Create indexes for efficient queries
             # Single-column indexes
@@ -107,6 +581,17 @@ class DatabaseManager:
                 ON messages(creator_uid, uid, ttl)
             """)
 
+            # Covering indexes for keyset pagination: seek by (created_at, id)
+            # and read ttl/custom_name without touching the table rows
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_uid_keyset
+                ON messages(uid, created_at DESC, id DESC, ttl, custom_name)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_pending_keyset
+                ON messages(creator_uid, uid, created_at DESC, id DESC, ttl, custom_name)
+            """)
+
             # Optimizes cleanup_expired_messages query
             cursor.execute("""
                 CREATE INDEX IF NOT EXISTS idx_messages_ttl_created_cleanup
@@ -114,272 +599,1387 @@ class DatabaseManager:
             """)
             
             conn.commit()
+
+            self._init_counters(conn)
             logger.info(f"Database initialized at {self.db_path}")
+
+    def _enable_incremental_vacuum(self, conn: sqlite3.Connection):
+        """Switch the database to auto_vacuum=INCREMENTAL.
+
+        This lets the expiry sweeper hand freed pages back to the
+        filesystem. Changing the mode of an initialized (WAL) database
+        takes a one-time VACUUM. That is instant for a new database; for an
+        existing one it rewrites the whole file and needs about as much
+        free space again, so it only runs from the migrate command.
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        logger.info("Enabling incremental auto-vacuum (one-time VACUUM)")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def _require_migrated(self, conn: sqlite3.Connection):
+        """Refuse to start on a schema only the migrate command can convert"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(messages)")}
+        if 'encrypted_message' in columns:
+            raise MigrationRequiredError(
+                f"{self.db_path} stores ciphertext inline in messages; "
+                f"run `python -m database migrate` before starting the app"
+            )
+        # Reads look for expiring payloads only in their day partition
+        unpartitioned = conn.execute("""
+            SELECT 1 FROM message_payloads p JOIN messages m ON m.id = p.id WHERE m.ttl != ? LIMIT 1
+        """, (PERMANENT_TTL,)).fetchone()
+        if unpartitioned:
+            raise MigrationRequiredError(
+                f"{self.db_path} has expiring payloads outside their day partitions; "
+                f"run `python -m database migrate` before starting the app"
+            )
+
+    def _migrate_inline_payloads(self, conn: sqlite3.Connection):
+        """Move ciphertext out of databases created with the inline schema.
+
+        Copies every payload and rewrites the messages table (DROP COLUMN),
+        in one transaction; only the migrate command runs it.
+        """
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(messages)")}
+        if 'encrypted_message' not in columns:
+            return
+
+        logger.info("Migrating inline message payloads to message_payloads")
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            INSERT OR REPLACE INTO message_payloads (id, encrypted_message)
+            SELECT id, encrypted_message FROM messages
+        """)
+        conn.execute("ALTER TABLE messages ADD COLUMN payload_size INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE messages SET payload_size = length(encrypted_message)")
+        conn.execute("ALTER TABLE messages DROP COLUMN encrypted_message")
+        conn.commit()
+        logger.info("Inline payload migration completed")
+
+    def _load_partitions(self, conn: sqlite3.Connection):
+        """Discover the payload partition tables already in the database"""
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        with self._partitions_lock:
+            self._partitions = {row['name'] for row in rows if PARTITION_TABLE_REGEX.match(row['name'])}
+
+    def _ensure_partition(self, conn: sqlite3.Connection, table: str):
+        """Create a payload partition table on first use"""
+        if table == PAYLOAD_TABLE:
+            return
+        with self._partitions_lock:
+            if table in self._partitions:
+                return
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id TEXT PRIMARY KEY,
+                encrypted_message BLOB NOT NULL
+            )
+        """)
+        with self._partitions_lock:
+            self._partitions.add(table)
+
+    def _migrate_payload_partitions(self, conn: sqlite3.Connection):
+        """Move expiring payloads out of message_payloads into their day partitions.
+
+        Needed once for databases created before partitioning; one
+        transaction per expiry day. Only the migrate command runs it.
+        """
+        days = [row[0] for row in conn.execute("""
+            SELECT DISTINCT m.ttl / ? FROM message_payloads p JOIN messages m ON m.id = p.id
+            WHERE m.ttl != ?
+        """, (PARTITION_SECONDS, PERMANENT_TTL))]
+        if not days:
+            return
+
+        logger.info(f"Moving expiring payloads into {len(days)} day partitions")
+        for day in days:
+            table = payload_partition(day * PARTITION_SECONDS)
+            day_range = (day * PARTITION_SECONDS, (day + 1) * PARTITION_SECONDS, PERMANENT_TTL)
+            self._ensure_partition(conn, table)
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {table} (id, encrypted_message)
+                SELECT p.id, p.encrypted_message FROM message_payloads p JOIN messages m ON m.id = p.id
+                WHERE m.ttl >= ? AND m.ttl < ? AND m.ttl != ?
+            """, day_range)
+            conn.execute("""
+                DELETE FROM message_payloads WHERE id IN (
+                    SELECT id FROM messages WHERE ttl >= ? AND ttl < ? AND ttl != ?
+                )
+            """, day_range)
+            conn.commit()
+        logger.info("Payload partition migration completed")
+
+    def _init_counters(self, conn: sqlite3.Connection):
+        """Create the per-user counters table and the triggers that maintain it.
+
+        user_counters holds, per uid, how many stored messages it owns and
+        how many unclaimed messages it created. Triggers on messages keep
+        it in step inside the same transaction as every insert, claim,
+        delete and cleanup, so list totals are a primary-key lookup.
+        Expired rows stay counted until the cleanup job deletes them.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_counters'"
+        ).fetchone()
+        if exists:
+            return
+
+        # Backfill and trigger creation must be atomic with respect to writers
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE TABLE user_counters (
+                uid TEXT PRIMARY KEY,
+                owned INTEGER NOT NULL DEFAULT 0,
+                pending INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            INSERT INTO user_counters (uid, owned)
+            SELECT uid, COUNT(*) FROM messages WHERE uid != '' GROUP BY uid
+        """)
+        conn.execute("""
+            INSERT INTO user_counters (uid, pending)
+            SELECT creator_uid, COUNT(*) FROM messages
+            WHERE uid = '' AND creator_uid != '' GROUP BY creator_uid
+            ON CONFLICT(uid) DO UPDATE SET pending = excluded.pending
+        """)
+        for statement in COUNTER_TRIGGERS:
+            conn.execute(statement)
+        conn.commit()
+        logger.info("Per-user counters table created and backfilled")
     
     @contextmanager
-    def get_connection(self):
-        """Get database connection with proper error handling"""
+    def get_connection(self, operation: str = "query"):
+        """Borrow a pooled database connection with proper error handling.
+
+        With a query_observer set, the time the connection is held and the
+        number of rows it changed are reported under ``operation``.
+        """
         conn = None
+        discard = False
+        started = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.execute('PRAGMA journal_mode=WAL')
-            conn.execute('PRAGMA busy_timeout=5000')
-            conn.row_factory = sqlite3.Row  # Enable dict-like access
+            conn = self.pool.acquire()
+            if self.query_observer is not None:
+                started, changes = time.perf_counter(), conn.total_changes
             yield conn
         except Exception as e:
             if conn:
-                conn.rollback()
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    discard = True
             logger.error(f"Database error: {e}")
             raise
         finally:
             if conn:
-                conn.close()
+                if started is not None:
+                    self.query_observer(operation, time.perf_counter() - started, conn.total_changes - changes)
+                self.pool.release(conn, discard=discard)
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Connection pool statistics"""
+        return self.pool.stats()
+
+    def write_lock_stats(self) -> Dict[str, float]:
+        """Write lock contention counters (see _write)"""
+        with self._lock_stats_lock:
+            return dict(self._lock_stats)
+
+    def _record_lock_wait(self, waited: float, retried: bool = False, failed: bool = False):
+        with self._lock_stats_lock:
+            self._lock_stats["lock_wait_seconds_total"] += waited
+            self._lock_stats["lock_wait_max_seconds"] = max(self._lock_stats["lock_wait_max_seconds"], waited)
+            if retried:
+                self._lock_stats["busy_retries"] += 1
+            elif failed:
+                self._lock_stats["busy_failures"] += 1
+            else:
+                self._lock_stats["transactions"] += 1
+
+    def _rollback_write(self, conn: sqlite3.Connection):
+        conn.rollback()
+        # A rolled-back transaction may have created a payload partition
+        self._load_partitions(conn)
+
+    def _write(self, func: Callable[..., T], *args) -> T:
+        """Run ``func(conn, *args)`` in one write transaction and commit it.
+
+        BEGIN IMMEDIATE takes the write lock up front, so a transaction can
+        never fail half-way while upgrading a read lock. If the lock is still
+        held by another writer after busy_timeout, the whole transaction is
+        retried up to ``busy_retries`` times with capped exponential backoff
+        and full jitter, so colliding writers do not retry in lockstep.
+        """
+        with self.get_connection(func.__name__.lstrip("_")) as conn:
+            attempt = 0
+            while True:
+                started = time.monotonic()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError as e:
+                    waited = time.monotonic() - started
+                    if not is_busy_error(e) or attempt >= self.busy_retries:
+                        self._record_lock_wait(waited, failed=is_busy_error(e))
+                        raise
+                    self._record_lock_wait(waited, retried=True)
+                    attempt += 1
+                    backoff = min(self.busy_backoff_max, self.busy_backoff * 2 ** attempt)
+                    delay = random.uniform(0, backoff)
+                    logger.debug(f"Write lock busy, retry {attempt}/{self.busy_retries} in {delay:.3f}s")
+                    with self._lock_stats_lock:
+                        self._lock_stats["backoff_seconds_total"] += delay
+                    time.sleep(delay)
+                    continue
+                self._record_lock_wait(time.monotonic() - started)
+
+                try:
+                    result = func(conn, *args)
+                    conn.commit()
+                    return result
+                except Exception:
+                    self._rollback_write(conn)
+                    raise
+
+    def close(self):
+        """Close all pooled connections"""
+        self.pool.close()
+
+    def rebuild_id_filter(self):
+        """Build a fresh id filter from the messages table and swap it in.
+
+        Ids added while the table is being scanned are replayed into the
+        new filter before the swap, so it never misses a live message.
+        """
+        with self._id_filter_lock:
+            self._id_filter_log = []
+        try:
+            with self.get_connection("rebuild_id_filter") as conn:
+                count = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+                id_filter = MessageIdFilter(max(self.id_filter_capacity, 2 * count), self.id_filter_fp_rate)
+                for row in conn.execute("SELECT id FROM messages"):
+                    id_filter.add(row[0])
+            with self._id_filter_lock:
+                for message_id in self._id_filter_log:
+                    id_filter.add(message_id)
+                self.id_filter = id_filter
+                self._id_filter_stats["rebuilds"] += 1
+        finally:
+            with self._id_filter_lock:
+                self._id_filter_log = None
+        logger.info(
+            f"Message id filter built: {id_filter.count} ids, capacity {id_filter.capacity}, "
+            f"{id_filter.memory_bytes} bytes"
+        )
+
+    def maintain_id_filter(self) -> bool:
+        """Rebuild the id filter once it holds more ids than it was sized for"""
+        with self._id_filter_lock:
+            full = self.id_filter.count > self.id_filter.capacity
+        if full:
+            self.rebuild_id_filter()
+        return full
+
+    def _remember_ids(self, *message_ids: str):
+        with self._id_filter_lock:
+            for message_id in message_ids:
+                self.id_filter.add(message_id)
+            if self._id_filter_log is not None:
+                self._id_filter_log.extend(message_ids)
+
+    def _forget_ids(self, id_filter: MessageIdFilter, *message_ids: str):
+        # Removal goes to the filter that was current when the delete began.
+        # If a rebuild swapped in a new one meanwhile, it either scanned the
+        # row (a harmless stale positive) or never held it, and removing
+        # from it would zero counters other ids rely on.
+        with self._id_filter_lock:
+            for message_id in message_ids:
+                id_filter.remove(message_id)
+
+    def may_exist(self, message_id: str) -> bool:
+        """False only if message_id is definitely not stored"""
+        with self._id_filter_lock:
+            found = self.id_filter.might_contain(message_id)
+            self._id_filter_stats["checks"] += 1
+            if not found:
+                self._id_filter_stats["definite_misses"] += 1
+        return found
+
+    def id_filter_stats(self) -> Dict[str, Any]:
+        """Id filter size, memory footprint and false-positive rate"""
+        with self._id_filter_lock:
+            stats: Dict[str, Any] = dict(self._id_filter_stats)
+            stats.update({
+                "ids": self.id_filter.count,
+                "capacity": self.id_filter.capacity,
+                "hashes": self.id_filter.hashes,
+                "memory_bytes": self.id_filter.memory_bytes,
+                "estimated_fp_rate": round(self.id_filter.estimated_fp_rate(), 6),
+            })
+        return stats
     
     def store_message(self, message_id: str, data: Dict[str, Any]) -> bool:
-        """Store message data in database"""
+        """Store message data in database.
+
+        Ciphertext, IV and salt arrive as base64 and are stored as raw bytes.
+        The ciphertext goes to the payload partition for the message's TTL.
+        """
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO messages 
-                    (id, ttl, uid, encrypted_message, iv, salt, custom_name, creator_uid)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    message_id,
-                    data['ttl'],
-                    data.get('uid', ''),
-                    data['encrypted_message'],
-                    data['iv'],
-                    data['salt'],
-                    data.get('custom_name', ''),
-                    data.get('creator_uid', '')
-                ))
-                conn.commit()
-                logger.debug(f"Message {message_id} stored successfully")
-                return True
+            stored = self._write(self._store_message, message_id, data)
         except Exception as e:
             logger.error(f"Error storing message {message_id}: {e}")
             return False
+        self._remember_ids(message_id)
+        return stored
+
+    def _store_message(self, conn: sqlite3.Connection, message_id: str, data: Dict[str, Any]) -> bool:
+        self._ensure_partition(conn, payload_partition(data['ttl']))
+        payload = b64_to_blob(data['encrypted_message'])
+        self._insert_message_row(conn, message_id, data, len(payload))
+        conn.execute(f"""
+            INSERT INTO {payload_partition(data['ttl'])} (id, encrypted_message) VALUES (?, ?)
+        """, (message_id, payload))
+        logger.debug(f"Message {message_id} stored successfully")
+        return True
+
+    def _insert_message_row(self, conn: sqlite3.Connection, message_id: str, data: Dict[str, Any],
+                            payload_size: int) -> bool:
+        conn.execute("""
+            INSERT INTO messages 
+            (id, ttl, uid, iv, salt, custom_name, creator_uid, payload_size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            message_id,
+            data['ttl'],
+            data.get('uid', ''),
+            b64_to_blob(data['iv']),
+            b64_to_blob(data['salt']),
+            data.get('custom_name', ''),
+            data.get('creator_uid', ''),
+            payload_size
+        ))
+        return True
+
+    def begin_payload_upload(self, message_id: str, ttl: int, size: int) -> int:
+        """Reserve a zero-filled payload row of ``size`` bytes for a streamed upload.
+
+        The row has no metadata yet, so the message stays invisible until
+        finish_payload_upload commits it. The id is registered as in flight
+        before the row is committed, so delete_orphan_payloads leaves it
+        alone. Returns the payload rowid.
+        """
+        with self._uploads_lock:
+            self._uploads.add(message_id)
+        try:
+            return self._write(self._reserve_payload, message_id, payload_partition(ttl), size)
+        except BaseException:
+            with self._uploads_lock:
+                self._uploads.discard(message_id)
+            raise
+
+    def _reserve_payload(self, conn: sqlite3.Connection, message_id: str, table: str, size: int) -> int:
+        self._ensure_partition(conn, table)
+        cursor = conn.execute(f"""
+            INSERT INTO {table} (id, encrypted_message) VALUES (?, zeroblob(?))
+        """, (message_id, size))
+        return cursor.lastrowid
+
+    def write_payload_chunk(self, ttl: int, rowid: int, offset: int, chunk: bytes):
+        """Write one chunk of a streamed upload in place (incremental blob I/O)"""
+        self._write(self._write_blob, payload_partition(ttl), rowid, offset, chunk)
+
+    @staticmethod
+    def _write_blob(conn: sqlite3.Connection, table: str, rowid: int, offset: int, chunk: bytes):
+        with conn.blobopen(table, "encrypted_message", rowid) as blob:
+            blob.seek(offset)
+            blob.write(chunk)
+
+    def finish_payload_upload(self, message_id: str, data: Dict[str, Any], size: int) -> bool:
+        """Insert the metadata row that makes a streamed upload visible"""
+        self._write(self._insert_message_row, message_id, data, size)
+        with self._uploads_lock:
+            self._uploads.discard(message_id)
+        self._remember_ids(message_id)
+        logger.debug(f"Message {message_id} stored successfully ({size} bytes streamed)")
+        return True
+
+    def abort_payload_upload(self, message_id: str, ttl: int):
+        """Remove the reserved payload row of an upload that did not complete"""
+        try:
+            self._write(self._delete_payload, message_id, payload_partition(ttl))
+        finally:
+            with self._uploads_lock:
+                self._uploads.discard(message_id)
+
+    @staticmethod
+    def _delete_payload(conn: sqlite3.Connection, message_id: str, table: str):
+        conn.execute(f"DELETE FROM {table} WHERE id = ?", (message_id,))
     
     def retrieve_message(self, message_id: str) -> Optional[Dict[str, Any]]:
-        """Retrieve message data from database"""
+        """Retrieve message data from database.
+
+        encrypted_message, iv and salt are returned as stored (raw bytes);
+        use blob_to_b64 to turn them back into base64 for API responses.
+        The metadata row's TTL routes the lookup to its payload partition.
+        Repeat lookups are served from the message cache.
+        """
+        cached = self.cache.get(message_id)
+        if cached is not None:
+            return cached
+        return self._load_message(message_id)
+
+    def _load_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        generation = self.cache.generation
         try:
-            with self.get_connection() as conn:
+            with self.get_connection("retrieve_message") as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT * FROM messages WHERE id = ?
-                """, (message_id,))
+                cursor.execute("SELECT * FROM messages WHERE id = ?", (message_id,))
                 row = cursor.fetchone()
-                
-                if row:
-                    return dict(row)
-                return None
+                if row is None:
+                    return None
+
+                table = payload_partition(row['ttl'])
+                with self._partitions_lock:
+                    if table != PAYLOAD_TABLE and table not in self._partitions:
+                        return None  # expiry day already dropped
+                cursor.execute(f"SELECT encrypted_message FROM {table} WHERE id = ?", (message_id,))
+                payload = cursor.fetchone()
+                if payload is None:
+                    return None
+
+                message = dict(row)
+                message['encrypted_message'] = payload['encrypted_message']
+            if message['ttl'] >= int(time.time()):
+                self.cache.put(message_id, message, generation)
+            return message
         except Exception as e:
             logger.error(f"Error retrieving message {message_id}: {e}")
             return None
     
-    def update_message_owner(self, message_id: str, uid: str, encrypted_message: str,
-                           iv: str, salt: str) -> Dict[str, Any]:
-        """Update message owner and content. Returns structured result matching Workers."""
+    def retrieve_message_metadata(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Like retrieve_message, but instead of the ciphertext returns where
+        it lives: payload_table, payload_rowid and payload_size (bytes).
+
+        Used to stream large payloads with read_payload_chunk. Legacy
+        payloads still stored as base64 TEXT come back as-is in
+        encrypted_message; they may not even be canonical base64, so only
+        the JSON view can serve them.
+        """
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
+            with self.get_connection("retrieve_message_metadata") as conn:
+                row = conn.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+                if row is None:
+                    return None
 
-                cursor.execute("""
-                    UPDATE messages
-                    SET uid = ?, encrypted_message = ?, iv = ?, salt = ?
-                    WHERE id = ? AND uid = ''
-                """, (uid, encrypted_message, iv, salt, message_id))
-                conn.commit()
+                table = payload_partition(row['ttl'])
+                with self._partitions_lock:
+                    if table != PAYLOAD_TABLE and table not in self._partitions:
+                        return None  # expiry day already dropped
+                payload = conn.execute(f"""
+                    SELECT rowid, length(encrypted_message) AS size, typeof(encrypted_message) AS type
+                    FROM {table} WHERE id = ?
+                """, (message_id,)).fetchone()
+                if payload is None:
+                    return None
 
-                if cursor.rowcount > 0:
-                    logger.debug(f"Message {message_id} owner updated successfully")
-                    return {"ok": True}
+                message = dict(row)
+                message.update(payload_table=table, payload_rowid=payload['rowid'], payload_size=payload['size'])
+                if payload['type'] == 'text':
+                    message['encrypted_message'] = conn.execute(
+                        f"SELECT encrypted_message FROM {table} WHERE id = ?", (message_id,)).fetchone()[0]
+                return message
+        except Exception as e:
+            logger.error(f"Error retrieving message metadata {message_id}: {e}")
+            return None
 
-                # Distinguish: not found vs already owned
-                cursor.execute("SELECT uid FROM messages WHERE id = ?", (message_id,))
-                row = cursor.fetchone()
-                if row is None:
-                    return {"ok": False, "error": "not_found"}
-                return {"ok": False, "error": "already_owned"}
+    def read_payload_chunk(self, message: Dict[str, Any], offset: int, size: int) -> bytes:
+        """Read ``size`` payload bytes at ``offset`` with incremental blob I/O.
+
+        ``message`` comes from retrieve_message_metadata. Each chunk is read
+        in its own short read transaction together with the message's IV;
+        if the IV changed (claimed and re-encrypted) or the message is gone,
+        PayloadChangedError is raised instead of mixing two ciphertexts.
+        """
+        with self.get_connection("read_payload_chunk") as conn:
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT iv FROM messages WHERE id = ?", (message['id'],)).fetchone()
+                if row is None or row['iv'] != message['iv']:
+                    raise PayloadChangedError(f"Message {message['id']} changed while streaming")
+                with conn.blobopen(message['payload_table'], "encrypted_message", message['payload_rowid'],
+                                   readonly=True) as blob:
+                    blob.seek(offset)
+                    return blob.read(size)
+            except sqlite3.OperationalError as e:
+                # The payload row or its partition disappeared mid-stream
+                raise PayloadChangedError(f"Message {message['id']} changed while streaming") from e
+            finally:
+                conn.rollback()
+
+    def update_message_owner(self, message_id: str, uid: str, encrypted_message: str,
+                           iv: str, salt: str) -> Dict[str, Any]:
+        """Update message owner and content. Returns structured result matching Workers."""
+        try:
+            return self._write(self._update_message_owner, message_id, uid, encrypted_message, iv, salt)
         except Exception as e:
             logger.error(f"Error updating message owner {message_id}: {e}")
             return {"ok": False, "error": "db_error"}
+        finally:
+            self.cache.invalidate(message_id)
+
+    def _update_message_owner(self, conn: sqlite3.Connection, message_id: str, uid: str,
+                              encrypted_message: str, iv: str, salt: str) -> Dict[str, Any]:
+        payload = b64_to_blob(encrypted_message)
+        cursor = conn.cursor()
+
+        # The TTL routes the payload update; a missing row is not_found
+        cursor.execute("SELECT ttl FROM messages WHERE id = ?", (message_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return {"ok": False, "error": "not_found"}
+
+        cursor.execute("""
+            UPDATE messages
+            SET uid = ?, iv = ?, salt = ?, payload_size = ?
+            WHERE id = ? AND uid = ''
+        """, (uid, b64_to_blob(iv), b64_to_blob(salt), len(payload), message_id))
+        if cursor.rowcount == 0:
+            return {"ok": False, "error": "already_owned"}
+
+        cursor.execute(f"""
+            UPDATE {payload_partition(row['ttl'])} SET encrypted_message = ? WHERE id = ?
+        """, (payload, message_id))
+        logger.debug(f"Message {message_id} owner updated successfully")
+        return {"ok": True}
     
     def update_custom_name(self, message_id: str, uid: str, custom_name: str) -> bool:
         """Update custom name for a message"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE messages
-                    SET custom_name = ?
-                    WHERE id = ? AND uid = ?
-                """, (custom_name, message_id, uid))
-                conn.commit()
-
-                if cursor.rowcount > 0:
-                    logger.debug(f"Custom name updated for message {message_id}")
-                    return True
-                else:
-                    logger.warning(f"Message {message_id} not found or access denied")
-                    return False
+            return self._write(self._update_custom_name, message_id, uid, custom_name)
         except Exception as e:
             logger.error(f"Error updating custom name for {message_id}: {e}")
             return False
+        finally:
+            self.cache.invalidate(message_id)
+
+    def _update_custom_name(self, conn: sqlite3.Connection, message_id: str, uid: str, custom_name: str) -> bool:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE messages
+            SET custom_name = ?
+            WHERE id = ? AND uid = ?
+        """, (custom_name, message_id, uid))
+
+        if cursor.rowcount > 0:
+            logger.debug(f"Custom name updated for message {message_id}")
+            return True
+        else:
+            logger.warning(f"Message {message_id} not found or access denied")
+            return False
     
     def delete_message(self, message_id: str, uid: str) -> Dict[str, Any]:
         """Delete a message (only if user owns it or created it). Returns structured result."""
+        id_filter = self.id_filter
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                # Delete if user owns it or created it (for pending messages)
-                cursor.execute("""
-                    DELETE FROM messages
-                    WHERE id = ? AND (uid = ? OR (uid = '' AND creator_uid = ?))
-                """, (message_id, uid, uid))
-                conn.commit()
-
-                if cursor.rowcount > 0:
-                    logger.debug(f"Message {message_id} deleted successfully")
-                    return {"ok": True}
-                else:
-                    logger.warning(f"Message {message_id} not found or access denied")
-                    return {"ok": False, "error": "not_found"}
+            result = self._write(self._delete_message, message_id, uid)
         except Exception as e:
             logger.error(f"Error deleting message {message_id}: {e}")
             return {"ok": False, "error": "db_error"}
-    
-    def list_user_secrets(self, uid: str, page: int = 1, per_page: int = 10) -> Dict[str, Any]:
-        """List user's owned secrets with pagination"""
+        finally:
+            self.cache.invalidate(message_id)
+        if result["ok"]:
+            self._forget_ids(id_filter, message_id)
+        return result
+
+    def _delete_message(self, conn: sqlite3.Connection, message_id: str, uid: str) -> Dict[str, Any]:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ttl FROM messages WHERE id = ?", (message_id,))
+        row = cursor.fetchone()
+
+        # Delete if user owns it or created it (for pending messages)
+        cursor.execute("""
+            DELETE FROM messages
+            WHERE id = ? AND (uid = ? OR (uid = '' AND creator_uid = ?))
+        """, (message_id, uid, uid))
+        deleted = cursor.rowcount > 0
+        table = payload_partition(row['ttl']) if row else PAYLOAD_TABLE
+        if deleted and table != PAYLOAD_TABLE:
+            with self._partitions_lock:
+                has_partition = table in self._partitions
+            if has_partition:
+                cursor.execute(f"DELETE FROM {table} WHERE id = ?", (message_id,))
+
+        if deleted:
+            logger.debug(f"Message {message_id} deleted successfully")
+            return {"ok": True}
+        else:
+            logger.warning(f"Message {message_id} not found or access denied")
+            return {"ok": False, "error": "not_found"}
+
+    @staticmethod
+    def _write_failure(name: str) -> Any:
+        """Result a batchable write returns when it fails"""
+        if name == "delete_message":
+            return {"ok": False, "error": "db_error"}
+        return False
+
+    def write_batch(self, ops: List[Tuple[str, tuple]]) -> List[Any]:
+        """Run many store_message / update_custom_name / delete_message calls
+        in one transaction (group commit).
+
+        ``ops`` holds (method name, args) pairs. Each call runs in its own
+        savepoint, so a failing call is rolled back alone while the rest
+        commit together with a single WAL sync. Returns each call's usual
+        structured result, in order.
+        """
+        id_filter = self.id_filter
         try:
-            current_time = int(time.time())
-            offset = (page - 1) * per_page
-            
-            logger.debug(f"Listing secrets for uid: {uid}, current_time: {current_time}")
-            
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Debug: Check all messages for this uid
-                cursor.execute("SELECT id, uid, ttl FROM messages WHERE uid = ?", (uid,))
-                all_user_messages = cursor.fetchall()
-                logger.debug(f"All messages for uid {uid}: {all_user_messages}")
-                
-                # Get total count
-                cursor.execute("""
-                    SELECT COUNT(*) FROM messages
-                    WHERE uid = ? AND (ttl > ? OR ttl = ?)
-                """, (uid, current_time, PERMANENT_TTL))
-                total = cursor.fetchone()[0]
-                logger.debug(f"Total count for uid {uid}: {total}")
-
-                # Get paginated results
-                cursor.execute("""
-                    SELECT id, custom_name, ttl, created_at
-                    FROM messages
-                    WHERE uid = ? AND (ttl > ? OR ttl = ?)
-                    ORDER BY created_at DESC
+            results = self._write(self._write_batch, ops)
+        except Exception as e:
+            logger.error(f"Error committing batch of {len(ops)} writes: {e}")
+            return [self._write_failure(name) for name, _ in ops]
+        finally:
+            # Store-only batches leave the cache (and its generation) alone
+            changed = [args[0] for name, args in ops if name != "store_message"]
+            if changed:
+                self.cache.invalidate(*changed)
+
+        self._remember_ids(*(
+            args[0] for (name, args), result in zip(ops, results) if name == "store_message" and result
+        ))
+        self._forget_ids(id_filter, *(
+            args[0] for (name, args), result in zip(ops, results) if name == "delete_message" and result["ok"]
+        ))
+        return results
+
+    def _write_batch(self, conn: sqlite3.Connection, ops: List[Tuple[str, tuple]]) -> List[Any]:
+        runners = {
+            "store_message": self._store_message,
+            "update_custom_name": self._update_custom_name,
+            "delete_message": self._delete_message,
+        }
+        # Partition DDL must not be undone by a rolled-back savepoint
+        for name, args in ops:
+            if name == "store_message":
+                self._ensure_partition(conn, payload_partition(args[1]['ttl']))
+
+        results = []
+        for name, args in ops:
+            conn.execute("SAVEPOINT batch_write")
+            try:
+                results.append(runners[name](conn, *args))
+            except Exception as e:
+                conn.execute("ROLLBACK TO batch_write")
+                logger.error(f"Error in batched {name} for message {args[0]}: {e}")
+                results.append(self._write_failure(name))
+            conn.execute("RELEASE batch_write")
+        return results
+    
+    def _list_secrets(self, where: str, params: Tuple, counter: str, page: int, per_page: int,
+                      cursor: Optional[str], include_total: bool) -> Dict[str, Any]:
+        """Shared page/keyset listing over live messages matching ``where``.
+
+        Rows are ordered by (created_at, id) descending. With a cursor the
+        query seeks straight past the previous page's last row, so deep
+        pages cost the same as the first; without one it falls back to
+        OFFSET paging. One extra row is fetched to compute has_more, and
+        the total is read from the ``counter`` column of user_counters.
+        That counter still includes expired rows the sweeper has not
+        deleted yet, so on the last page the total is replaced by the
+        live count; clients never see pages that turn out empty.
+        """
+        current_time = int(time.time())
+        live = f"{where} AND (ttl > ? OR ttl = ?)"
+        live_params = params + (current_time, PERMANENT_TTL)
+
+        with self.get_connection(f"list_{counter}_secrets") as conn:
+            cursor_obj = conn.cursor()
+
+            total = None
+            if include_total:
+                cursor_obj.execute(f"SELECT {counter} FROM user_counters WHERE uid = ?", params[:1])
+                row = cursor_obj.fetchone()
+                total = max(0, row[0]) if row else 0
+
+            if cursor is not None:
+                query = f"SELECT id, custom_name, ttl, created_at FROM messages WHERE {live}"
+                query_params = live_params
+                if cursor:
+                    query += " AND (created_at, id) < (?, ?)"
+                    query_params += decode_cursor(cursor)
+                query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+                cursor_obj.execute(query, query_params + (per_page + 1,))
+            else:
+                cursor_obj.execute(f"""
+                    SELECT id, custom_name, ttl, created_at FROM messages WHERE {live}
+                    ORDER BY created_at DESC, id DESC
                     LIMIT ? OFFSET ?
-                """, (uid, current_time, PERMANENT_TTL, per_page, offset))
-                
-                secrets = []
-                for row in cursor.fetchall():
-                    row = dict(row)
-                    # Calculate time remaining with smart formatting
-                    time_remaining = calculate_time_remaining(row['ttl'], current_time)
-                    
-                    secrets.append({
-                        "id": row['id'],
-                        "custom_name": row['custom_name'] or "",
-                        "days_remaining": time_remaining["value"],
-                        "time_remaining_display": time_remaining["display"],
-                        "time_remaining_type": time_remaining["type"]
-                    })
-                
-                logger.debug(f"Found {len(secrets)} secrets for uid {uid}")
-                
-                return {
-                    "secrets": secrets,
-                    "page": page,
-                    "per_page": per_page,
-                    "total": total,
-                    "has_more": (offset + per_page) < total
-                }
+                """, live_params + (per_page + 1, (page - 1) * per_page))
+
+            rows = cursor_obj.fetchall()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+
+            if include_total and not has_more:
+                if cursor is None and (rows or page == 1):
+                    total = (page - 1) * per_page + len(rows)
+                elif cursor == "":
+                    total = len(rows)
+                else:
+                    # Past the end, or a cursor page with no offset to add to
+                    cursor_obj.execute(f"SELECT COUNT(*) FROM messages WHERE {live}", live_params)
+                    total = cursor_obj.fetchone()[0]
+
+        secrets = []
+        for row in rows:
+            # Calculate time remaining with smart formatting
+            time_remaining = calculate_time_remaining(row['ttl'], current_time)
+
+            secrets.append({
+                "id": row['id'],
+                "custom_name": row['custom_name'] or "",
+                "days_remaining": time_remaining["value"],
+                "time_remaining_display": time_remaining["display"],
+                "time_remaining_type": time_remaining["type"]
+            })
+
+        result: Dict[str, Any] = {"secrets": secrets, "per_page": per_page}
+        if cursor is None:
+            result["page"] = page
+        if include_total:
+            result["total"] = total
+        result["has_more"] = has_more
+        result["next_cursor"] = encode_cursor(rows[-1]['created_at'], rows[-1]['id']) if has_more else None
+        return result
+
+    @staticmethod
+    def _empty_list(page: int, per_page: int, cursor: Optional[str], include_total: bool) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"secrets": [], "per_page": per_page}
+        if cursor is None:
+            result["page"] = page
+        if include_total:
+            result["total"] = 0
+        result["has_more"] = False
+        result["next_cursor"] = None
+        return result
+
+    def list_user_secrets(self, uid: str, page: int = 1, per_page: int = 10,
+                          cursor: Optional[str] = None, include_total: bool = True) -> Dict[str, Any]:
+        """List user's owned secrets with page or cursor pagination"""
+        try:
+            logger.debug(f"Listing secrets for uid: {uid}")
+            result = self._list_secrets("uid = ?", (uid,), "owned", page, per_page, cursor, include_total)
+            logger.debug(f"Found {len(result['secrets'])} secrets for uid {uid}")
+            return result
         except Exception as e:
             logger.error(f"Error listing user secrets: {e}")
-            return {"secrets": [], "page": page, "per_page": per_page, "total": 0, "has_more": False}
-    
-    def list_pending_secrets(self, creator_uid: str, page: int = 1, per_page: int = 10) -> Dict[str, Any]:
-        """List user's pending (unclaimed) secrets with pagination"""
+            return self._empty_list(page, per_page, cursor, include_total)
+
+    def list_pending_secrets(self, creator_uid: str, page: int = 1, per_page: int = 10,
+                             cursor: Optional[str] = None, include_total: bool = True) -> Dict[str, Any]:
+        """List user's pending (unclaimed) secrets with page or cursor pagination"""
         try:
-            current_time = int(time.time())
-            offset = (page - 1) * per_page
-            
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Get total count
-                cursor.execute("""
-                    SELECT COUNT(*) FROM messages
-                    WHERE creator_uid = ? AND uid = '' AND (ttl > ? OR ttl = ?)
-                """, (creator_uid, current_time, PERMANENT_TTL))
-                total = cursor.fetchone()[0]
-
-                # Get paginated results
-                cursor.execute("""
-                    SELECT id, custom_name, ttl, created_at
-                    FROM messages
-                    WHERE creator_uid = ? AND uid = '' AND (ttl > ? OR ttl = ?)
-                    ORDER BY created_at DESC
-                    LIMIT ? OFFSET ?
-                """, (creator_uid, current_time, PERMANENT_TTL, per_page, offset))
-                
-                secrets = []
-                for row in cursor.fetchall():
-                    row = dict(row)
-                    # Calculate time remaining with smart formatting
-                    time_remaining = calculate_time_remaining(row['ttl'], current_time)
-                    
-                    secrets.append({
-                        "id": row['id'],
-                        "custom_name": row['custom_name'] or "",
-                        "days_remaining": time_remaining["value"],
-                        "time_remaining_display": time_remaining["display"],
-                        "time_remaining_type": time_remaining["type"]
-                    })
-                
-                return {
-                    "secrets": secrets,
-                    "page": page,
-                    "per_page": per_page,
-                    "total": total,
-                    "has_more": (offset + per_page) < total
-                }
+            return self._list_secrets(
+                "creator_uid = ? AND uid = ''", (creator_uid,), "pending", page, per_page, cursor, include_total
+            )
         except Exception as e:
             logger.error(f"Error listing pending secrets: {e}")
-            return {"secrets": [], "page": page, "per_page": per_page, "total": 0, "has_more": False}
+            return self._empty_list(page, per_page, cursor, include_total)
     
-    def cleanup_expired_messages(self) -> int:
-        """Remove expired messages.
+    def delete_expired_batch(self, limit: int) -> int:
+        """Delete up to ``limit`` expired messages in one short transaction.
 
         Permanent messages (ttl = PERMANENT_TTL) and messages whose TTL has
-        not passed are never deleted, regardless of age.
+        not passed are never deleted, regardless of age. Triggers adjust
+        user_counters in the same transaction; the ciphertext is reclaimed
+        when drop_expired_partitions drops the message's expiry day.
         """
-        try:
-            current_time = int(time.time())
+        id_filter = self.id_filter
+        deleted = self._write(self._delete_expired_batch, int(time.time()), limit)
+        if deleted:
+            self.cache.purge_expired()
+            self._forget_ids(id_filter, *deleted)
+        return len(deleted)
 
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    DELETE FROM messages
-                    WHERE ttl < ? AND ttl != ?
-                """, (current_time, PERMANENT_TTL))
-                
-                deleted_count = cursor.rowcount
-                conn.commit()
-                logger.info(f"Cleanup completed. Deleted {deleted_count} expired messages")
-                return deleted_count
+    def _delete_expired_batch(self, conn: sqlite3.Connection, current_time: int, limit: int) -> List[str]:
+        rows = conn.execute("""
+            DELETE FROM messages WHERE id IN (
+                SELECT id FROM messages
+                WHERE ttl < ? AND ttl != ?
+                ORDER BY ttl
+                LIMIT ?
+            )
+            RETURNING id
+        """, (current_time, PERMANENT_TTL, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def drop_expired_partitions(self) -> int:
+        """Drop every payload partition whose whole expiry day has passed.
+
+        Any metadata rows of that day the batched sweep has not reached yet
+        are deleted in the same transaction, so no message ever points at a
+        dropped table. Returns the number of partitions dropped.
+        """
+        current_day = int(time.time()) // PARTITION_SECONDS
+        with self._partitions_lock:
+            expired = sorted(
+                table for table in self._partitions
+                if int(PARTITION_TABLE_REGEX.match(table).group(1)) < current_day
+            )
+
+        for table in expired:
+            id_filter = self.id_filter
+            leftover = self._write(self._drop_partition, table)
+            with self._partitions_lock:
+                self._partitions.discard(table)
+            self._forget_ids(id_filter, *leftover)
+            logger.info(f"Dropped expired payload partition {table} ({len(leftover)} leftover messages)")
+        return len(expired)
+
+    def _drop_partition(self, conn: sqlite3.Connection, table: str) -> List[str]:
+        day = int(PARTITION_TABLE_REGEX.match(table).group(1))
+        rows = conn.execute("""
+            DELETE FROM messages WHERE ttl >= ? AND ttl < ? RETURNING id
+        """, (day * PARTITION_SECONDS, (day + 1) * PARTITION_SECONDS)).fetchall()
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        return [row[0] for row in rows]
+
+    def delete_orphan_payloads(self) -> int:
+        """Delete payload rows that have no metadata row.
+
+        A streamed upload commits its payload row before its metadata row;
+        if the process dies in between, abort_payload_upload never runs and
+        the row would stay forever. Candidates are found on a read
+        connection and rechecked inside the write transaction, skipping
+        uploads still in flight in this process. Returns rows deleted.
+        """
+        with self._partitions_lock:
+            tables = [PAYLOAD_TABLE] + sorted(self._partitions)
+        deleted = 0
+        for table in tables:
+            with self.get_connection("find_orphan_payloads") as conn:
+                candidates = [row[0] for row in conn.execute(f"""
+                    SELECT id FROM {table} WHERE id NOT IN (SELECT id FROM messages)
+                """)]
+            if candidates:
+                deleted += self._write(self._delete_orphans, table, candidates)
+        if deleted:
+            logger.info(f"Deleted {deleted} orphaned payload rows")
+        return deleted
+
+    def _delete_orphans(self, conn: sqlite3.Connection, table: str, candidates: List[str]) -> int:
+        # Read under the write lock: an upload registers its id before its
+        # payload row can commit, so every committed in-flight row is listed
+        with self._uploads_lock:
+            orphans = [message_id for message_id in candidates if message_id not in self._uploads]
+        deleted = 0
+        for start in range(0, len(orphans), 500):
+            chunk = orphans[start:start + 500]
+            cursor = conn.execute(f"""
+                DELETE FROM {table}
+                WHERE id IN ({",".join("?" * len(chunk))})
+                  AND id NOT IN (SELECT id FROM messages)
+            """, chunk)
+            deleted += cursor.rowcount
+        return deleted
+
+    def legacy_base64_pending(self) -> bool:
+        """True until convert_legacy_base64 has scanned every table once"""
+        return self._legacy_tables is None or bool(self._legacy_tables)
+
+    def convert_legacy_base64(self, limit: int = 500) -> int:
+        """Convert up to ``limit`` base64 TEXT values written by older versions to BLOBs.
+
+        TEXT rows keep working as they are, so this runs in the background
+        (see ExpirySweeper) instead of at startup. Candidates are found on
+        a read connection, resuming after the last id scanned, and only
+        they are rewritten in a short write transaction. Values that are
+        not canonical base64 stay TEXT. Returns the number of rows converted.
+        """
+        if self._legacy_tables is None:
+            with self._partitions_lock:
+                payload_tables = [PAYLOAD_TABLE] + sorted(self._partitions)
+            self._legacy_tables = [("messages", ("iv", "salt"))] + [
+                (table, ("encrypted_message",)) for table in payload_tables
+            ]
+        while self._legacy_tables:
+            table, columns = self._legacy_tables[0]
+            text_filter = " OR ".join(f"typeof({c}) = 'text'" for c in columns)
+            try:
+                with self.get_connection("find_legacy_base64") as conn:
+                    candidates = [row[0] for row in conn.execute(f"""
+                        SELECT id FROM {table} WHERE id > ? AND ({text_filter}) ORDER BY id LIMIT ?
+                    """, (self._legacy_after_id, limit))]
+            except sqlite3.OperationalError:
+                candidates = []  # partition dropped since the list was taken
+            if len(candidates) < limit:
+                self._legacy_tables.pop(0)
+                self._legacy_after_id = ""
+            else:
+                self._legacy_after_id = candidates[-1]
+            if candidates:
+                converted = self._write(self._convert_base64_rows, table, columns, candidates)
+                if converted:
+                    self.cache.invalidate(*candidates)
+                return converted
+        return 0
+
+    @staticmethod
+    def _convert_base64_rows(conn: sqlite3.Connection, table: str, columns: Tuple[str, ...],
+                             candidates: List[str]) -> int:
+        rows = conn.execute(f"""
+            SELECT id, {", ".join(columns)} FROM {table} WHERE id IN ({",".join("?" * len(candidates))})
+        """, candidates).fetchall()
+        converted = 0
+        for row in rows:
+            values = [b64_to_blob(row[c]) for c in columns]
+            if all(value is row[c] for value, c in zip(values, columns)):
+                continue  # not canonical base64, or already converted
+            conn.execute(
+                f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                (*values, row['id'])
+            )
+            if table != "messages" and isinstance(values[0], bytes):
+                conn.execute("UPDATE messages SET payload_size = ? WHERE id = ?", (len(values[0]), row['id']))
+            converted += 1
+        return converted
+
+    def count_expired(self, cap: int = 100000) -> int:
+        """Estimate the expiry backlog (exact up to ``cap``)"""
+        with self.get_connection("count_expired") as conn:
+            row = conn.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM messages WHERE ttl < ? AND ttl != ? LIMIT ?
+                )
+            """, (int(time.time()), PERMANENT_TTL, cap)).fetchone()
+            return row[0]
+
+    def incremental_vacuum(self, max_pages: int = 1000) -> int:
+        """Return up to ``max_pages`` free pages to the filesystem; returns pages freed"""
+        with self.get_connection("incremental_vacuum") as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # The pragma frees one page per step; execute() would only step it
+            # once, executescript() runs it to completion
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return before - after
+
+    def cleanup_expired_messages(self, batch_size: int = 1000) -> int:
+        """Remove all expired messages, one bounded batch per transaction,
+        then drop the payload partitions of fully expired days"""
+        deleted_count = 0
+        try:
+            while True:
+                deleted = self.delete_expired_batch(batch_size)
+                deleted_count += deleted
+                if deleted < batch_size:
+                    break
+            self.drop_expired_partitions()
+            logger.info(f"Cleanup completed. Deleted {deleted_count} expired messages")
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
-            return 0
+        return deleted_count
+
+
+class AsyncDatabaseManager:
+    """Awaitable facade over DatabaseManager.
+
+    Every call runs on a dedicated, bounded thread pool (one worker per
+    pooled connection), so a slow fsync or busy-timeout wait blocks only
+    that worker instead of the event loop. Results are the same structured
+    values the synchronous methods return.
+
+    store_message, update_custom_name and delete_message are group-committed:
+    calls arriving within ``batch_window`` seconds, or while the previous
+    batch is committing, share one transaction (DatabaseManager.write_batch)
+    of at most ``max_batch`` writes.
+    """
+
+    def __init__(self, db: DatabaseManager, max_workers: Optional[int] = None,
+                 batch_window: float = 0.002, max_batch: int = 128):
+        self.db = db
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or db.pool.max_size,
+            thread_name_prefix="sqlite",
+        )
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._pending_writes: List[Tuple[str, tuple, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_task: Optional[asyncio.Task] = None
+        self._write_stats = {"batches": 0, "writes": 0, "largest_batch": 0}
+
+    async def _run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        # Carry context vars (e.g. the request id used in log records) into the worker
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+    async def _write(self, name: str, *args) -> Any:
+        """Queue a write for the next group commit and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_writes.append((name, args, future))
+        if self._batch_task is None and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush_writes)
+        return await future
+
+    def _flush_writes(self):
+        self._flush_handle = None
+        if self._batch_task is not None or not self._pending_writes:
+            return
+        batch = self._pending_writes[:self.max_batch]
+        del self._pending_writes[:self.max_batch]
+        self._batch_task = asyncio.get_running_loop().create_task(self._commit_batch(batch))
+
+    async def _commit_batch(self, batch: List[Tuple[str, tuple, asyncio.Future]]):
+        try:
+            results = await self._run(self.db.write_batch, [(name, args) for name, args, _ in batch])
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._write_stats["batches"] += 1
+            self._write_stats["writes"] += len(batch)
+            self._write_stats["largest_batch"] = max(self._write_stats["largest_batch"], len(batch))
+            self._batch_task = None
+            # Writes that queued up during this commit form the next batch
+            self._flush_writes()
+
+    async def flush_writes(self):
+        """Wait until every queued write has been committed"""
+        while self._pending_writes or self._batch_task is not None:
+            if self._batch_task is None:
+                if self._flush_handle is not None:
+                    self._flush_handle.cancel()
+                self._flush_writes()
+            await asyncio.shield(self._batch_task)
+
+    def write_stats(self) -> Dict[str, int]:
+        """Group commit counters"""
+        stats = dict(self._write_stats)
+        stats["pending"] = len(self._pending_writes)
+        return stats
+
+    async def store_message(self, message_id: str, data: Dict[str, Any]) -> bool:
+        return await self._write("store_message", message_id, data)
+
+    async def store_message_stream(self, message_id: str, data: Dict[str, Any], size: int,
+                                   chunks: AsyncIterator[bytes], chunk_size: int = 256 * 1024) -> bool:
+        """Store a message whose ciphertext arrives as a stream of raw bytes.
+
+        ``data`` is store_message's dict without encrypted_message. The
+        stream is written into a preallocated ``size``-byte BLOB in
+        ``chunk_size`` pieces, so at most about one chunk is held in memory.
+        Each chunk is its own BEGIN IMMEDIATE/commit, i.e. one write-lock
+        acquisition and one fsync per chunk.
+        Raises ValueError if the stream is not exactly ``size`` bytes long;
+        returns False on a database error. A partial upload is removed.
+        """
+        try:
+            rowid = await self._run(self.db.begin_payload_upload, message_id, data['ttl'], size)
+        except Exception as e:
+            logger.error(f"Error starting upload for message {message_id}: {e}")
+            return False
+
+        offset = 0
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                if offset + len(buffer) + len(chunk) > size:
+                    raise ValueError("Body is longer than Content-Length")
+                buffer += chunk
+                if len(buffer) >= chunk_size:
+                    await self._run(self.db.write_payload_chunk, data['ttl'], rowid, offset, bytes(buffer))
+                    offset += len(buffer)
+                    buffer.clear()
+            if buffer:
+                await self._run(self.db.write_payload_chunk, data['ttl'], rowid, offset, bytes(buffer))
+                offset += len(buffer)
+            if offset != size:
+                raise ValueError("Body is shorter than Content-Length")
+            return await self._run(self.db.finish_payload_upload, message_id, data, size)
+        except BaseException as e:
+            try:
+                await self._run(self.db.abort_payload_upload, message_id, data['ttl'])
+            except Exception as cleanup_error:
+                logger.error(f"Error removing partial upload for message {message_id}: {cleanup_error}")
+            if isinstance(e, sqlite3.Error):
+                logger.error(f"Error storing streamed message {message_id}: {e}")
+                return False
+            raise
+
+    async def retrieve_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        # Cache hits and definite misses are answered on the event loop
+        cached = self.db.cache.get(message_id)
+        if cached is not None:
+            return cached
+        if not self.db.may_exist(message_id):
+            return None
+        return await self._run(self.db._load_message, message_id)
+
+    async def open_message_stream(self, message_id: str, chunk_size: int = 64 * 1024
+                                  ) -> Optional[Tuple[Dict[str, Any], AsyncIterator[bytes]]]:
+        """Metadata of a message plus an async iterator over its raw ciphertext.
+
+        The metadata dict is retrieve_message's without encrypted_message,
+        with payload_size set. Cached messages stream from memory; others
+        are read ``chunk_size`` bytes at a time, each read on the executor,
+        so memory stays at about one chunk whatever the payload size.
+
+        Legacy TEXT payloads are not streamed: the iterator is None and
+        the metadata keeps encrypted_message as stored.
+        """
+        cached = self.db.cache.get(message_id)
+        if cached is not None:
+            if isinstance(cached['encrypted_message'], str):
+                return cached, None
+            payload = cached.pop('encrypted_message')
+            cached['payload_size'] = len(payload)
+            return cached, self._iter_bytes(payload, chunk_size)
+        if not self.db.may_exist(message_id):
+            return None
+
+        message = await self._run(self.db.retrieve_message_metadata, message_id)
+        if message is None:
+            return None
+        if 'encrypted_message' in message:
+            return message, None
+        return message, self._payload_chunks(message, chunk_size)
+
+    @staticmethod
+    async def _iter_bytes(payload: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+        view = memoryview(payload)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+
+    async def _payload_chunks(self, message: Dict[str, Any], chunk_size: int) -> AsyncIterator[bytes]:
+        for offset in range(0, message['payload_size'], chunk_size):
+            yield await self._run(self.db.read_payload_chunk, message, offset, chunk_size)
+
+    async def update_message_owner(self, message_id: str, uid: str, encrypted_message: str,
+                                   iv: str, salt: str) -> Dict[str, Any]:
+        if not self.db.may_exist(message_id):
+            return {"ok": False, "error": "not_found"}
+        return await self._run(self.db.update_message_owner, message_id, uid, encrypted_message, iv, salt)
+
+    async def update_custom_name(self, message_id: str, uid: str, custom_name: str) -> bool:
+        return await self._write("update_custom_name", message_id, uid, custom_name)
+
+    async def delete_message(self, message_id: str, uid: str) -> Dict[str, Any]:
+        if not self.db.may_exist(message_id):
+            return {"ok": False, "error": "not_found"}
+        return await self._write("delete_message", message_id, uid)
+
+    async def list_user_secrets(self, uid: str, page: int = 1, per_page: int = 10,
+                                cursor: Optional[str] = None, include_total: bool = True) -> Dict[str, Any]:
+        return await self._run(self.db.list_user_secrets, uid, page, per_page, cursor, include_total)
+
+    async def list_pending_secrets(self, creator_uid: str, page: int = 1, per_page: int = 10,
+                                   cursor: Optional[str] = None, include_total: bool = True) -> Dict[str, Any]:
+        return await self._run(self.db.list_pending_secrets, creator_uid, page, per_page, cursor, include_total)
+
+    async def delete_expired_batch(self, limit: int) -> int:
+        return await self._run(self.db.delete_expired_batch, limit)
+
+    async def drop_expired_partitions(self) -> int:
+        return await self._run(self.db.drop_expired_partitions)
+
+    async def maintain_id_filter(self) -> bool:
+        return await self._run(self.db.maintain_id_filter)
+
+    async def delete_orphan_payloads(self) -> int:
+        return await self._run(self.db.delete_orphan_payloads)
+
+    async def convert_legacy_base64(self, limit: int = 500) -> int:
+        return await self._run(self.db.convert_legacy_base64, limit)
+
+    def legacy_base64_pending(self) -> bool:
+        return self.db.legacy_base64_pending()
+
+    async def count_expired(self, cap: int = 100000) -> int:
+        return await self._run(self.db.count_expired, cap)
+
+    async def incremental_vacuum(self, max_pages: int = 1000) -> int:
+        return await self._run(self.db.incremental_vacuum, max_pages)
+
+    def close(self):
+        """Wait for in-flight work, then close the underlying pool"""
+        self.executor.shutdown(wait=True)
+        self.db.close()
+
+
+class ExpirySweeper:
+    """Continuously deletes expired messages in small, self-paced batches.
+
+    Each batch is its own short write transaction run on the database
+    executor, so the event loop is never blocked and other writers get the
+    lock between batches. Each sweep counts the backlog first and starts
+    with a batch of that size, within ``min_batch``..``max_batch``; after
+    that the batch size adapts to write contention: a batch slower than
+    ``target_batch_seconds`` (e.g. because it waited on busy_timeout)
+    halves the next one, a fast one doubles it. Between batches the
+    sweeper spreads the remaining backlog over about ``idle_interval``
+    seconds, but always pauses long enough to hold the lock at most
+    ``duty_cycle`` of the time. Once the backlog is drained, payload partitions of fully
+    expired days are dropped, payload rows left behind by interrupted
+    uploads are deleted, base64 TEXT rows from older versions are
+    converted to BLOBs (once per process, in paced batches), freed pages are returned to the filesystem
+    with PRAGMA incremental_vacuum and the sweeper idles for
+    ``idle_interval`` seconds.
+    """
+
+    def __init__(self, db: AsyncDatabaseManager, idle_interval: float = 60.0,
+                 min_batch: int = 50, max_batch: int = 5000,
+                 target_batch_seconds: float = 0.05, duty_cycle: float = 0.25,
+                 vacuum_pages: int = 1000):
+        self.db = db
+        self.idle_interval = idle_interval
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.target_batch_seconds = target_batch_seconds
+        self.duty_cycle = duty_cycle
+        self.vacuum_pages = vacuum_pages
+        self.batch_size = min_batch
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "deleted_total": 0,
+            "batches_total": 0,
+            "sweeps_total": 0,
+            "partitions_dropped_total": 0,
+            "orphans_deleted_total": 0,
+            "legacy_rows_converted_total": 0,
+            "pages_vacuumed_total": 0,
+            "errors_total": 0,
+            "backlog": 0,
+            "batch_size": self.batch_size,
+            "last_sweep_at": 0,
+        }
+
+    def start(self):
+        """Start the background sweep loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the sweep loop, waiting for the current batch to finish"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        """Progress counters for monitoring"""
+        stats = dict(self._stats)
+        stats["batch_size"] = self.batch_size
+        return stats
+
+    async def sweep(self) -> int:
+        """Drain the current expiry backlog; returns messages deleted"""
+        self._stats["backlog"] = await self.db.count_expired()
+        if self._stats["backlog"]:
+            logger.info(f"Expiry sweep started, backlog ~{self._stats['backlog']} messages")
+            self.batch_size = max(self.min_batch, min(self.max_batch, self._stats["backlog"]))
+
+        deleted_total = 0
+        while True:
+            started = time.monotonic()
+            deleted = await self.db.delete_expired_batch(self.batch_size)
+            elapsed = time.monotonic() - started
+
+            deleted_total += deleted
+            self._stats["deleted_total"] += deleted
+            self._stats["batches_total"] += 1
+            self._stats["backlog"] = max(0, self._stats["backlog"] - deleted)
+
+            if deleted < self.batch_size:
+                break
+
+            if elapsed > self.target_batch_seconds:
+                self.batch_size = max(self.min_batch, self.batch_size // 2)
+            elif elapsed < self.target_batch_seconds / 2:
+                self.batch_size = min(self.max_batch, self.batch_size * 2)
+
+            if not self._stats["backlog"]:
+                # The estimate is capped (see count_expired); count again
+                self._stats["backlog"] = await self.db.count_expired()
+                if not self._stats["backlog"]:
+                    break
+            # Spread what is left over the idle interval, but leave the write
+            # lock free for at least (1 - duty_cycle) of the time
+            remaining = max(1, math.ceil(self._stats["backlog"] / self.batch_size))
+            await asyncio.sleep(max(
+                elapsed * (1 - self.duty_cycle) / self.duty_cycle,
+                self.idle_interval / (remaining + 1) - elapsed,
+            ))
+
+        self._stats["backlog"] = 0
+        dropped = await self.db.drop_expired_partitions()
+        self._stats["partitions_dropped_total"] += dropped
+        orphans = await self.db.delete_orphan_payloads()
+        self._stats["orphans_deleted_total"] += orphans
+        await self._convert_legacy_base64()
+        await self.db.maintain_id_filter()
+        self._stats["sweeps_total"] += 1
+        self._stats["last_sweep_at"] = int(time.time())
+        if deleted_total or dropped or orphans:
+            freed = await self.db.incremental_vacuum(self.vacuum_pages)
+            self._stats["pages_vacuumed_total"] += freed
+            logger.info(
+                f"Expiry sweep completed. Deleted {deleted_total} expired messages, "
+                f"dropped {dropped} partitions, freed {freed} pages"
+            )
+        return deleted_total
+
+    async def _convert_legacy_base64(self):
+        """Convert base64 TEXT rows left by older versions, paced like expiry batches"""
+        while self.db.legacy_base64_pending():
+            started = time.monotonic()
+            converted = await self.db.convert_legacy_base64(self.max_batch)
+            elapsed = time.monotonic() - started
+            self._stats["legacy_rows_converted_total"] += converted
+            if not self.db.legacy_base64_pending():
+                if self._stats["legacy_rows_converted_total"]:
+                    logger.info(
+                        f"Converted {self._stats['legacy_rows_converted_total']} base64 rows to BLOB storage"
+                    )
+                break
+            await asyncio.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors_total"] += 1
+                logger.error(f"Error during expiry sweep: {e}")
+            await asyncio.sleep(self.idle_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inigma database maintenance")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", default="data/inigma.db", help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    # VACUUM writes a temporary copy of the database; keep it on the data
+    # volume rather than in a /tmp that may be read-only or too small
+    os.environ.setdefault("SQLITE_TMPDIR", str(Path(args.db).resolve().parent))
+    DatabaseManager(args.db, run_migrations=True).close()
+    logger.info(f"Database {args.db} is migrated")
+
+
+if __name__ == "__main__":
+    main()
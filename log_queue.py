@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Queued logging: callers enqueue, a background thread formats and writes.
+
+Logging on the event loop only resolves the message and puts the record on
+a bounded queue; a QueueListener thread runs the formatter and the real
+handler. When the queue is full the record is dropped and counted rather
+than blocking the caller. INFO and DEBUG records are additionally
+rate-sampled per logger, so hot-path lines cannot flood the queue, while
+warnings and errors always get through.
+"""
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterable, List
+
+
+class RateSamplingFilter(logging.Filter):
+    """Token bucket per logger name for records at INFO and below.
+
+    Each logger may emit ``rate`` such records per second on average, with
+    bursts up to ``burst``; the rest are dropped and counted. A rate of 0
+    disables sampling.
+    """
+    def __init__(self, rate: float, burst: float = 0):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or rate
+        self.sampled_out = 0
+        self._buckets: Dict[str, List[float]] = {}  # name -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno > logging.INFO:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return True
+            bucket[0] = tokens
+            self.sampled_out += 1
+            return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full.
+
+    Formatting is left to the listener thread. prepare() only resolves
+    %-style args, so mutable arguments cannot change before the record is
+    written; the record is not copied, as this is the only handler.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class _BlockingSentinelListener(QueueListener):
+    """QueueListener whose stop() waits for room instead of failing on a full queue"""
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class QueuedLogging:
+    """Wires a handler behind a bounded queue and a listener thread.
+
+    Attach ``handler`` to loggers. Filters that read per-request state (such
+    as context vars) are passed in ``filters`` so they run on the calling
+    thread, before sampling and queueing.
+    """
+    def __init__(self, target: logging.Handler, queue_size: int = 10000,
+                 rate_limit: float = 0, filters: Iterable[logging.Filter] = ()):
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        for f in filters:
+            self.handler.addFilter(f)
+        self.sampler = RateSamplingFilter(rate_limit)
+        self.handler.addFilter(self.sampler)
+        self.listener = _BlockingSentinelListener(self.queue, target, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        """Write out everything still queued and stop the listener thread"""
+        if self._started:
+            self.listener.stop()
+            self._started = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dropped_overflow": self.handler.dropped,
+            "sampled_out": self.sampler.sampled_out,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "rate_limit_per_logger": self.sampler.rate,
+        }
@@ -1,25 +1,32 @@
 #!/usr/bin/env python3
+import atexit
 import contextvars
 import os
-import json
 import logging
 import secrets
 import time
 import re
 import uuid
-from typing import Optional, Dict, Any
+from typing import Annotated, Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 from contextlib import asynccontextmanager
+from urllib.parse import quote
 
 from fastapi import FastAPI, HTTPException, Request, Response
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from typing_extensions import NotRequired, TypedDict
 import uvicorn
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
 
-from database import DatabaseManager, PERMANENT_TTL
+from database import (
+    AsyncDatabaseManager, DatabaseManager, ExpirySweeper, PERMANENT_TTL, blob_to_b64, decode_cursor
+)
+from log_queue import QueuedLogging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, LoopLagMonitor, MetricsRegistry
+from serialization import FastJSONResponse, TypedJSONResponse, json_dumps
+from template_cache import AssetStaticFiles, TemplateCache, TEMPLATE_BUILD_DIR
+import validation
 
 
 class JSONFormatter(logging.Formatter):
@@ -35,7 +42,7 @@ class JSONFormatter(logging.Formatter):
             entry["requestId"] = record.request_id
         if record.exc_info and record.exc_info[0]:
             entry["exception"] = self.formatException(record.exc_info)
-        return json.dumps(entry, ensure_ascii=False)
+        return json_dumps(entry).decode("utf-8")
 
 
 # Request ID is tracked per async context so concurrent requests never
@@ -52,70 +59,175 @@ class RequestIdFilter(logging.Filter):
         return True
 
 
-# Configure logging
+# Configure logging. Records are queued by the caller and formatted and
+# written to stdout by a background thread, so a slow log consumer never
+# stalls the event loop. Past LOG_QUEUE_SIZE pending records new ones are
+# dropped; INFO and below are capped at LOG_RATE_LIMIT records/s per logger
+# (0 = unlimited).
 handler = logging.StreamHandler()
 handler.setFormatter(JSONFormatter())
-handler.addFilter(RequestIdFilter())
-logging.basicConfig(level=logging.INFO, handlers=[handler])
+log_pipeline = QueuedLogging(
+    handler,
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+    rate_limit=float(os.getenv("LOG_RATE_LIMIT", 1000)),
+    filters=[RequestIdFilter()],
+)
+logging.basicConfig(level=logging.INFO, handlers=[log_pipeline.handler])
+log_pipeline.start()
+atexit.register(log_pipeline.stop)
 logger = logging.getLogger(__name__)
 
-# Template builder function
-def build_template_from_modular(template_name):
-    """Build template from modular components"""
-    # Defense-in-depth against path traversal: only allow plain *.html names.
-    if not re.match(r'^[a-zA-Z0-9_-]+\.html$', template_name):
-        raise ValueError(f"Invalid template name: {template_name}")
+# Passed to uvicorn.run instead of its default config, which would give the
+# uvicorn loggers their own synchronous stream handlers. Incremental, so the
+# handlers above are kept; the uvicorn loggers have none and propagate to
+# the root logger's queue handler.
+UVICORN_LOG_CONFIG = {
+    "version": 1,
+    "incremental": True,
+    "loggers": {
+        name: {"level": "INFO", "propagate": True}
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access")
+    },
+}
+
+# Compiled page templates (assembled once at startup, see template_cache.py).
+# TEMPLATE_RELOAD=1 rebuilds pages whose sources changed — development only.
+template_cache = TemplateCache(reload=os.getenv("TEMPLATE_RELOAD", "").lower() in ("1", "true", "yes"))
+# Prebuilt pages from `python -m template_cache build`, loaded at startup if present
+template_build_dir = os.getenv("TEMPLATE_BUILD_DIR", TEMPLATE_BUILD_DIR)
+
+# Metrics, served in the Prometheus text format from /metrics (see metrics.py)
+metrics_registry = MetricsRegistry()
+http_request_duration = metrics_registry.histogram(
+    "inigma_http_request_duration_seconds",
+    "Time from request start to the last response byte, by route and status",
+    ("method", "route", "status"),
+)
+db_query_duration = metrics_registry.histogram(
+    "inigma_db_query_duration_seconds",
+    "Time a database operation held its pooled connection",
+    ("operation",),
+)
+db_rows_changed = metrics_registry.counter(
+    "inigma_db_rows_changed", "Rows inserted, updated or deleted by database operations", ("operation",)
+)
+idempotency_lookups = metrics_registry.counter(
+    "inigma_idempotency_cache_lookups", "Idempotency cache lookups by result", ("result",)
+)
+idempotency_evictions = metrics_registry.counter(
+    "inigma_idempotency_cache_evictions", "Idempotency cache entries evicted to make room", ("reason",)
+)
+event_loop_lag = metrics_registry.histogram(
+    "inigma_event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+loop_lag_monitor = LoopLagMonitor(event_loop_lag)
 
-    template_path = f"templates-modular/pages/{template_name}"
 
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template not found: {template_path}")
-    
-    with open(template_path, 'r') as f:
-        content = f.read()
-    
-    # Process {{> filename }} includes
-    def replace_include(match):
-        filename = match.group(1).strip()
-        
-        # Determine file type and directory
-        if filename.endswith('.css'):
-            file_path = f"templates-modular/styles/{filename}"
-        elif filename.endswith('.js'):
-            file_path = f"templates-modular/scripts/{filename}"
-        else:
-            # HTML component
-            file_path = f"templates-modular/components/{filename}.html"
-        
-        if not os.path.exists(file_path):
-            logger.warning(f"Include file not found: {file_path}")
-            return f"<!-- Missing: {filename} -->"
-        
-        with open(file_path, 'r') as f:
-            return f.read()
-    
-    # Recursively resolve includes until none remain (max 10 levels)
-    for _ in range(10):
-        new_content = re.sub(r'\{\{>\s*([^}]+)\s*\}\}', replace_include, content)
-        if new_content == content:
-            break
-        content = new_content
+def observe_query(operation: str, seconds: float, rows_changed: int):
+    """DatabaseManager query_observer: feeds the db_* metrics"""
+    db_query_duration.observe(seconds, operation)
+    if rows_changed:
+        db_rows_changed.inc(operation, amount=rows_changed)
 
-    return content
 
 # Initialize database
-db = DatabaseManager()
+db = DatabaseManager(
+    pool_size=int(os.getenv("DB_POOL_SIZE", 8)),
+    busy_timeout_ms=int(os.getenv("DB_BUSY_TIMEOUT_MS", 1000)),
+    busy_retries=int(os.getenv("DB_BUSY_RETRIES", 5)),
+    cache_bytes=int(float(os.getenv("MESSAGE_CACHE_MB", 32)) * 1024 * 1024),
+    query_observer=observe_query,
+)
+# Request handlers go through the async facade so SQLite never blocks the loop;
+# writes arriving within WRITE_BATCH_WINDOW_MS of each other share one commit
+async_db = AsyncDatabaseManager(db, batch_window=float(os.getenv("WRITE_BATCH_WINDOW_MS", 2)) / 1000)
 
-# Initialize scheduler
-scheduler = AsyncIOScheduler()
+# Expired messages are removed continuously in small batches
+sweeper = ExpirySweeper(async_db, idle_interval=float(os.getenv("SWEEP_INTERVAL", 60)))
 
-def cleanup_database():
-    """Background task to cleanup expired messages"""
-    try:
-        deleted_count = db.cleanup_expired_messages()
-        logger.info(f"Scheduled cleanup completed. Deleted {deleted_count} expired messages")
-    except Exception as e:
-        logger.error(f"Error during scheduled cleanup: {e}")
+# Counters other components already keep are read at scrape time
+metrics_registry.callback(
+    "inigma_expired_messages_deleted", "Expired messages deleted by the sweeper", "counter",
+    lambda: sweeper.stats()["deleted_total"],
+)
+metrics_registry.callback(
+    "inigma_expired_partitions_dropped", "Expired payload partitions dropped by the sweeper", "counter",
+    lambda: sweeper.stats()["partitions_dropped_total"],
+)
+metrics_registry.callback(
+    "inigma_orphan_payloads_deleted", "Payload rows of interrupted uploads deleted by the sweeper", "counter",
+    lambda: sweeper.stats()["orphans_deleted_total"],
+)
+metrics_registry.callback(
+    "inigma_idempotency_cache_entries", "Entries in the idempotency cache", "gauge",
+    lambda: len(_idempotency_cache),
+)
+metrics_registry.callback(
+    "inigma_message_cache_lookups", "Message cache lookups by result", "counter",
+    lambda: {("hit",): db.cache.stats()["hits"], ("miss",): db.cache.stats()["misses"]},
+    ("result",),
+)
+metrics_registry.callback(
+    "inigma_log_records_dropped", "Log records dropped by the logging queue", "counter",
+    lambda: {("overflow",): log_pipeline.handler.dropped, ("sampled",): log_pipeline.sampler.sampled_out},
+    ("reason",),
+)
+metrics_registry.callback(
+    "inigma_id_filter_checks", "Message id lookups checked against the id filter", "counter",
+    lambda: db.id_filter_stats()["checks"],
+)
+metrics_registry.callback(
+    "inigma_id_filter_definite_misses", "Id filter checks answered without a database query", "counter",
+    lambda: db.id_filter_stats()["definite_misses"],
+)
+metrics_registry.callback(
+    "inigma_id_filter_memory_bytes", "Memory used by the id filter's bit array", "gauge",
+    lambda: db.id_filter_stats()["memory_bytes"],
+)
+metrics_registry.callback(
+    "inigma_id_filter_estimated_fp_rate", "Estimated false-positive rate of the id filter", "gauge",
+    lambda: db.id_filter_stats()["estimated_fp_rate"],
+)
+metrics_registry.callback(
+    "inigma_db_write_transactions", "Write transactions that acquired the write lock", "counter",
+    lambda: db.write_lock_stats()["transactions"],
+)
+metrics_registry.callback(
+    "inigma_db_write_lock_busy", "Write lock attempts that hit busy_timeout, by outcome", "counter",
+    lambda: {
+        ("retried",): db.write_lock_stats()["busy_retries"],
+        ("failed",): db.write_lock_stats()["busy_failures"],
+    },
+    ("outcome",),
+)
+metrics_registry.callback(
+    "inigma_db_write_lock_wait_seconds", "Time spent waiting for the write lock", "counter",
+    lambda: db.write_lock_stats()["lock_wait_seconds_total"],
+)
+metrics_registry.callback(
+    "inigma_db_write_lock_wait_max_seconds", "Longest single wait for the write lock", "gauge",
+    lambda: db.write_lock_stats()["lock_wait_max_seconds"],
+)
+metrics_registry.callback(
+    "inigma_db_write_backoff_seconds", "Time spent backing off between write lock retries", "counter",
+    lambda: db.write_lock_stats()["backoff_seconds_total"],
+)
+metrics_registry.callback(
+    "inigma_db_pool_connections", "Pooled database connections by state", "gauge",
+    lambda: {("in_use",): db.pool_stats()["in_use"], ("idle",): db.pool_stats()["idle"]},
+    ("state",),
+)
+metrics_registry.callback(
+    "inigma_db_pool_max_connections", "Connection pool size limit", "gauge",
+    lambda: db.pool_stats()["max_size"],
+)
+metrics_registry.callback(
+    "inigma_db_pool_events", "Connection pool events", "counter",
+    lambda: {(event,): value for event, value in db.pool_stats().items()
+             if event in ("created", "borrowed", "waits", "timeouts", "health_check_failures", "discarded")},
+    ("event",),
+)
 
 
 @asynccontextmanager
@@ -123,34 +235,32 @@ async def lifespan(app):
     """Application lifespan: startup and shutdown logic"""
     logger.info("Application starting up")
 
-    # Run initial cleanup
-    try:
-        db.cleanup_expired_messages()
-    except Exception as e:
-        logger.error(f"Failed to run startup cleanup: {e}")
-
-    # Schedule daily cleanup at 2:00 AM
-    scheduler.add_job(
-        cleanup_database,
-        CronTrigger(hour=2, minute=0),
-        id='daily_cleanup',
-        replace_existing=True
-    )
-    scheduler.start()
-    logger.info("Scheduler started - daily cleanup scheduled for 2:00 AM")
+    # Assemble pages up front so requests never touch the template files
+    template_cache.load(template_build_dir)
+
+    sweeper.start()
+    logger.info(f"Expiry sweeper started (idle interval {sweeper.idle_interval}s)")
+    loop_lag_monitor.start()
 
     yield
 
     logger.info("Application shutting down")
-    try:
-        if scheduler.running:
-            scheduler.shutdown()
-            logger.info("Scheduler stopped")
-    except Exception as e:
-        logger.error(f"Error shutting down scheduler: {e}")
+    await loop_lag_monitor.stop()
+    await sweeper.stop()
+    logger.info(f"Expiry sweeper stopped: {sweeper.stats()}")
 
+    await async_db.flush_writes()
+    logger.info(f"Write batching: {async_db.write_stats()}")
+    logger.info(f"Message cache: {db.cache.stats()}")
+    logger.info(f"Message id filter: {db.id_filter_stats()}")
+    logger.info(f"Write lock contention: {db.write_lock_stats()}")
+    logger.info(f"Closing database connection pool: {db.pool_stats()}")
+    logger.info(f"Logging queue: {log_pipeline.stats()}")
+    async_db.close()
 
-app = FastAPI(title="Inigma - Secure Message Sharing", lifespan=lifespan)
+
+app = FastAPI(title="Inigma - Secure Message Sharing", lifespan=lifespan,
+              default_response_class=FastJSONResponse)
 
 # Configure CORS with target domain restrictions
 allowed_origins = [
@@ -168,229 +278,195 @@ app.add_middleware(
     allow_origins=allowed_origins,
     allow_credentials=False,
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type"],
+    allow_headers=["Content-Type", "X-Secret-Metadata"],
+    expose_headers=["X-Secret-IV", "X-Secret-Salt", "X-Secret-Custom-Name", "X-Secret-Is-Owner"],
 )
 
 
-# Request ID + security headers middleware
-@app.middleware("http")
-async def request_middleware(request: Request, call_next):
-    request_id = uuid.uuid4().hex[:16]
-    token = request_id_var.set(request_id)
-    try:
-        logger.info("Incoming request")
-        response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id
-        return add_security_headers(response)
-    finally:
-        request_id_var.reset(token)
-
-
-# Data models
-MAX_ENCRYPTED_MESSAGE_SIZE = 2 * 1024 * 1024  # 2MB
-BASE64_REGEX = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
-UID_REGEX = re.compile(r'^[a-zA-Z0-9_-]{1,128}$')
-
-
-class CreateMessageRequest(BaseModel):
-    encrypted_message: str
-    iv: str
-    salt: str
-    ttl: Optional[int] = 30
-    custom_name: Optional[str] = ""
-    creator_uid: str
-    idempotency_key: Optional[str] = None
+# Security headers added to every response, pre-encoded once
+SECURITY_HEADERS: Tuple[Tuple[bytes, bytes], ...] = (
+    (b"x-frame-options", b"DENY"),
+    (b"x-content-type-options", b"nosniff"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"permissions-policy", b"camera=(), microphone=(), geolocation=(), payment=()"),
+)
+# Strict CSP for non-HTML (API) responses; HTML routes set a nonce-based CSP
+API_CSP_HEADER = (b"content-security-policy", b"default-src 'none'; frame-ancestors 'none'")
 
-    @field_validator('idempotency_key')
-    @classmethod
-    def validate_idempotency_key(cls, v: Optional[str]) -> Optional[str]:
-        if v is not None and (len(v) > 64 or not re.match(r'^[a-zA-Z0-9_-]+$', v)):
-            raise ValueError('Invalid idempotency key format')
-        return v
 
-    @field_validator('encrypted_message')
-    @classmethod
-    def validate_encrypted_message(cls, v: str) -> str:
-        if not v:
-            raise ValueError('Encrypted message cannot be empty')
-        if len(v) > MAX_ENCRYPTED_MESSAGE_SIZE:
-            raise ValueError('Encrypted message too large (max 2MB)')
-        if not BASE64_REGEX.match(v):
-            raise ValueError('Invalid base64 format')
-        return v
+class RequestContextMiddleware:
+    """Request ID, security headers and request metrics as a pure ASGI middleware.
 
-    @field_validator('iv')
-    @classmethod
-    def validate_iv(cls, v: str) -> str:
-        if not v or len(v) > 64:
-            raise ValueError('Invalid IV length')
-        if not re.match(r'^[A-Za-z0-9+/=]{1,64}$', v):
-            raise ValueError('Invalid IV format')
-        return v
+    Sets request_id_var for the request and appends X-Request-ID and the
+    security headers to the http.response.start message. Body messages
+    pass through untouched, so streaming responses are never buffered.
+    Once the response is complete its duration is recorded under the
+    matched route's path template, keeping label cardinality bounded.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        request_id = uuid.uuid4().hex[:16]
+        request_id_header = (b"x-request-id", request_id.encode("ascii"))
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = message.get("headers", [])
+                extra = [request_id_header, *SECURITY_HEADERS]
+                if not any(name == b"content-security-policy" for name, _ in headers):
+                    extra.append(API_CSP_HEADER)
+                message["headers"] = [*headers, *extra]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            logger.info("Incoming request")
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            request_id_var.reset(token)
+            http_request_duration.observe(
+                time.perf_counter() - started, scope["method"], route_label(scope), str(status)
+            )
+
+
+def route_label(scope: Scope) -> str:
+    """Path template of the route that handled the request, for metric labels"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("root_path"):  # inside a Mount, e.g. the static files
+        return scope["root_path"] + "/{path}"
+    return "unmatched"
+
+
+app.add_middleware(RequestContextMiddleware)
 
-    @field_validator('salt')
-    @classmethod
-    def validate_salt(cls, v: str) -> str:
-        if not v or len(v) > 128:
-            raise ValueError('Invalid salt length')
-        if not re.match(r'^[A-Za-z0-9+/=]{1,128}$', v):
-            raise ValueError('Invalid salt format')
-        return v
 
-    @field_validator('creator_uid')
-    @classmethod
-    def validate_creator_uid(cls, v: str) -> str:
-        if not v or not UID_REGEX.match(v):
-            raise ValueError('Invalid creator_uid format')
-        return v
+# Data models
+# Field types and the ciphertext check live in validation.py. Constraints on
+# ids, iv and salt run inside pydantic-core; encrypted_message is decoded by
+# its validator and holds the raw bytes that go to storage.
+MAX_BINARY_MESSAGE_SIZE = validation.MAX_ENCRYPTED_MESSAGE_SIZE * 3 // 4  # raw bytes of a 2MB base64 message
+SECRET_METADATA_HEADER = "X-Secret-Metadata"
+
+
+class SecretMetadata(BaseModel):
+    """Everything a create request carries besides the ciphertext"""
+    iv: validation.Base64IV
+    salt: validation.Base64Salt
+    ttl: Optional[int] = Field(30, ge=0, le=365)  # days; 0 = permanent
+    custom_name: Optional[str] = ""
+    creator_uid: validation.Uid
+    idempotency_key: Optional[validation.IdempotencyKey] = None
 
     @field_validator('custom_name')
     @classmethod
     def sanitize_custom_name_field(cls, v: Optional[str]) -> str:
         return sanitize_custom_name(v or "")
 
-    @field_validator('ttl')
-    @classmethod
-    def validate_ttl(cls, v: Optional[int]) -> Optional[int]:
-        if v is not None and (v < 0 or v > 365):
-            raise ValueError('TTL must be between 0 and 365 days')
-        return v
-
-class UpdateOwnerRequest(BaseModel):
-    view: str
-    uid: str
+class CreateMessageRequest(SecretMetadata):
     encrypted_message: str
-    iv: str
-    salt: str
-
-    @field_validator('view')
-    @classmethod
-    def validate_view_id(cls, v: str) -> str:
-        if not validate_message_id(v):
-            raise ValueError('Invalid message ID format')
-        return v
-
-    @field_validator('uid')
-    @classmethod
-    def validate_uid(cls, v: str) -> str:
-        if not v or not UID_REGEX.match(v):
-            raise ValueError('Invalid UID format')
-        return v
 
     @field_validator('encrypted_message')
     @classmethod
-    def validate_encrypted_message(cls, v: str) -> str:
-        if not v:
-            raise ValueError('Encrypted message cannot be empty')
-        if len(v) > MAX_ENCRYPTED_MESSAGE_SIZE:
-            raise ValueError('Encrypted message too large (max 2MB)')
-        if not BASE64_REGEX.match(v):
-            raise ValueError('Invalid base64 format')
-        return v
+    def validate_encrypted_message(cls, v: str) -> Union[bytes, str]:
+        return validation.validate_ciphertext(v)
 
-    @field_validator('iv')
-    @classmethod
-    def validate_iv(cls, v: str) -> str:
-        if not v or len(v) > 64:
-            raise ValueError('Invalid IV length')
-        if not re.match(r'^[A-Za-z0-9+/=]{1,64}$', v):
-            raise ValueError('Invalid IV format')
-        return v
+class UpdateOwnerRequest(BaseModel):
+    view: validation.MessageId
+    uid: validation.Uid
+    encrypted_message: str
+    iv: validation.Base64IV
+    salt: validation.Base64Salt
 
-    @field_validator('salt')
+    @field_validator('encrypted_message')
     @classmethod
-    def validate_salt(cls, v: str) -> str:
-        if not v or len(v) > 128:
-            raise ValueError('Invalid salt length')
-        if not re.match(r'^[A-Za-z0-9+/=]{1,128}$', v):
-            raise ValueError('Invalid salt format')
-        return v
+    def validate_encrypted_message(cls, v: str) -> Union[bytes, str]:
+        return validation.validate_ciphertext(v)
 
 class ViewMessageRequest(BaseModel):
-    view: str
-    uid: str
-
-    @field_validator('view')
-    @classmethod
-    def validate_view_id(cls, v: str) -> str:
-        if not validate_message_id(v):
-            raise ValueError('Invalid message ID format')
-        return v
-
-    @field_validator('uid')
-    @classmethod
-    def validate_uid(cls, v: str) -> str:
-        if not v or not UID_REGEX.match(v):
-            raise ValueError('Invalid UID format')
-        return v
+    view: validation.MessageId
+    uid: validation.Uid
 
 class ListSecretsRequest(BaseModel):
-    uid: str
-    page: int = 1
-    per_page: int = 10
-
-    @field_validator('uid')
-    @classmethod
-    def validate_uid(cls, v: str) -> str:
-        if not v or not UID_REGEX.match(v):
-            raise ValueError('Invalid UID format')
-        return v
-
-    @field_validator('page')
-    @classmethod
-    def validate_page(cls, v: int) -> int:
-        if v < 1:
-            raise ValueError('Page must be >= 1')
-        return v
-
-    @field_validator('per_page')
+    uid: validation.Uid
+    page: int = Field(1, ge=1)
+    per_page: int = Field(10, ge=1, le=100)
+    # Keyset pagination: "" requests the first page, then pass back next_cursor.
+    # When set, `page` is ignored.
+    cursor: Optional[str] = Field(None, max_length=128)
+    include_total: bool = True
+
+    @field_validator('cursor')
     @classmethod
-    def validate_per_page(cls, v: int) -> int:
-        if v < 1 or v > 100:
-            raise ValueError('Per page must be between 1 and 100')
+    def validate_cursor(cls, v: Optional[str]) -> Optional[str]:
+        if v:
+            decode_cursor(v)
         return v
 
 class UpdateCustomNameRequest(BaseModel):
-    view: str
-    uid: str
+    view: validation.MessageId
+    uid: validation.Uid
     custom_name: str
 
-    @field_validator('view')
-    @classmethod
-    def validate_view_id(cls, v: str) -> str:
-        if not validate_message_id(v):
-            raise ValueError('Invalid message ID format')
-        return v
-
-    @field_validator('uid')
-    @classmethod
-    def validate_uid(cls, v: str) -> str:
-        if not v or not UID_REGEX.match(v):
-            raise ValueError('Invalid UID format')
-        return v
-
     @field_validator('custom_name')
     @classmethod
     def sanitize_custom_name_field(cls, v: str) -> str:
         return sanitize_custom_name(v or "")
 
 class DeleteSecretRequest(BaseModel):
+    view: validation.MessageId
+    uid: validation.Uid
+
+# Response schemas. Handlers build these dicts and TypedJSONResponse
+# serializes them as-is (no validation), so keys and types must match.
+class CreateMessageResponse(TypedDict):
+    url: str
     view: str
-    uid: str
 
-    @field_validator('view')
-    @classmethod
-    def validate_view_id(cls, v: str) -> str:
-        if not validate_message_id(v):
-            raise ValueError('Invalid message ID format')
-        return v
+class ViewMessageResponse(TypedDict):
+    encrypted_message: str
+    iv: str
+    salt: str
+    custom_name: str
+    is_owner: bool
 
-    @field_validator('uid')
-    @classmethod
-    def validate_uid(cls, v: str) -> str:
-        if not v or not UID_REGEX.match(v):
-            raise ValueError('Invalid UID format')
-        return v
+class StatusResponse(TypedDict):
+    status: str
+    message: str
+
+class SecretSummary(TypedDict):
+    id: str
+    custom_name: str
+    days_remaining: int
+    time_remaining_display: str
+    time_remaining_type: str
+
+class SecretListResponse(TypedDict):
+    secrets: List[SecretSummary]
+    per_page: int
+    page: NotRequired[int]  # page-number pagination only
+    total: NotRequired[Annotated[int, Field(description=(
+        "Only with include_total. Read from a maintained per-user counter, so on pages before "
+        "the last it can include expired secrets the sweeper has not deleted yet; on the last "
+        "page it is the exact number of live secrets."
+    ))]]
+    has_more: bool
+    next_cursor: Optional[str]
+
+CREATE_RESPONSE = TypeAdapter(CreateMessageResponse)
+VIEW_RESPONSE = TypeAdapter(ViewMessageResponse)
+STATUS_RESPONSE = TypeAdapter(StatusResponse)
+SECRET_LIST_RESPONSE = TypeAdapter(SecretListResponse)
 
 def generate_random_string(length: int = 25) -> str:
     """Generate cryptographically secure random string"""
@@ -409,12 +485,6 @@ def sanitize_custom_name(name: str) -> str:
     
     return sanitized[:100]  # Limit to 100 characters
 
-def validate_message_id(message_id: str) -> bool:
-    """Validate message ID format"""
-    if not isinstance(message_id, str):
-        return False
-    return bool(re.match(r'^[a-zA-Z0-9_-]{1,50}$', message_id))
-
 def build_csp_with_nonce(nonce: str) -> str:
     """Build CSP header value with a per-request nonce (for HTML responses)"""
     return (
@@ -430,24 +500,6 @@ def build_csp_with_nonce(nonce: str) -> str:
     )
 
 
-def add_security_headers(response: Response) -> Response:
-    """Add security headers to response.
-
-    Skips CSP if already set (HTML routes set nonce-based CSP directly).
-    """
-    if "content-security-policy" not in response.headers:
-        # Strict CSP for non-HTML (API) responses
-        response.headers["Content-Security-Policy"] = (
-            "default-src 'none'; "
-            "frame-ancestors 'none'"
-        )
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-    response.headers["Permissions-Policy"] = "camera=(), microphone=(), geolocation=(), payment=()"
-
-    return response
-
 def get_timestamp() -> int:
     """Get current timestamp"""
     return int(time.time())
@@ -463,8 +515,12 @@ def check_idempotency(key: str) -> Optional[dict]:
     if key in _idempotency_cache:
         response, expires_at = _idempotency_cache[key]
         if time.time() < expires_at:
+            idempotency_lookups.inc("hit")
             return response
         del _idempotency_cache[key]
+        idempotency_lookups.inc("expired")
+        return None
+    idempotency_lookups.inc("miss")
     return None
 
 def store_idempotency(key: str, response: dict, ttl: int = 3600):
@@ -474,57 +530,74 @@ def store_idempotency(key: str, response: dict, ttl: int = 3600):
         expired = [k for k, (_, exp) in _idempotency_cache.items() if now >= exp]
         for k in expired:
             del _idempotency_cache[k]
+        if expired:
+            idempotency_evictions.inc("expired", amount=len(expired))
         # Still full — drop oldest entries to enforce the hard cap
         while len(_idempotency_cache) >= IDEMPOTENCY_CACHE_MAX:
             del _idempotency_cache[next(iter(_idempotency_cache))]
+            idempotency_evictions.inc("capacity")
     _idempotency_cache[key] = (response, time.time() + ttl)
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    """Serve main page"""
-    logger.info("Serving index page")
+def serve_page(request: Request, name: str) -> Response:
+    """Serve a compiled page, answering revalidations with 304.
+
+    Every response gets a fresh nonce. Only pages whose body does not embed
+    it (built with external assets) carry an ETag, so a 304 never has to
+    authorize a nonce from the client's cached copy.
+    """
+    page = template_cache.get(name)
     nonce = secrets.token_urlsafe(24)
-    content = build_template_from_modular("index.html").replace("__CSP_NONCE__", nonce)
+    if page.not_modified(request.headers.get("if-none-match", "")):
+        response = Response(status_code=304)
+    else:
+        response = HTMLResponse(page.render(nonce))
 
-    response = HTMLResponse(content)
+    if page.etag is not None:
+        response.headers["ETag"] = page.etag
+    response.headers["Cache-Control"] = "private, no-cache"
     response.headers["Content-Security-Policy"] = build_csp_with_nonce(nonce)
     return response
 
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    """Serve main page"""
+    logger.info("Serving index page")
+    return serve_page(request, "index.html")
+
 @app.get("/view", response_class=HTMLResponse)
-async def view_page():
+async def view_page(request: Request):
     """Serve view page"""
     logger.info("Serving view page")
-    nonce = secrets.token_urlsafe(24)
-    content = build_template_from_modular("view.html").replace("__CSP_NONCE__", nonce)
+    return serve_page(request, "view.html")
 
-    response = HTMLResponse(content)
-    response.headers["Content-Security-Policy"] = build_csp_with_nonce(nonce)
-    return response
+async def create_secret(metadata: SecretMetadata,
+                        store: Callable[[str, Dict[str, Any]], Awaitable[bool]]):
+    """Shared create flow: idempotency, TTL, id generation and the share link.
 
-@app.post("/api/create")
-async def create_message(request: CreateMessageRequest):
-    """Create a new encrypted message"""
+    ``store(message_id, message_data)`` persists the ciphertext along with
+    the metadata dict and returns False on a database error.
+    """
     # Idempotency check — key is scoped to creator_uid so one client cannot
     # poison another's cache
     idempotency_cache_key = (
-        f"{request.creator_uid}:{request.idempotency_key}"
-        if request.idempotency_key else None
+        f"{metadata.creator_uid}:{metadata.idempotency_key}"
+        if metadata.idempotency_key else None
     )
     if idempotency_cache_key:
         cached = check_idempotency(idempotency_cache_key)
         if cached:
             logger.info("Idempotent request: returning cached response")
-            return cached
+            return TypedJSONResponse(CREATE_RESPONSE, cached)
 
     logger.info("Creating new message")
     
     # Calculate TTL
-    if request.ttl == 0:
+    if metadata.ttl == 0:
         ttl = PERMANENT_TTL
         logger.debug("Setting permanent TTL")
     else:
-        ttl = get_timestamp() + (request.ttl * 24 * 60 * 60)
-        logger.debug(f"Setting TTL to {request.ttl} days")
+        ttl = get_timestamp() + (metadata.ttl * 24 * 60 * 60)
+        logger.debug(f"Setting TTL to {metadata.ttl} days")
     
     # Generate unique message ID
     message_id = generate_random_string(25)
@@ -534,15 +607,14 @@ async def create_message(request: CreateMessageRequest):
     message_data = {
         "ttl": ttl,
         "uid": "",
-        "encrypted_message": request.encrypted_message,
-        "iv": request.iv,
-        "salt": request.salt,
-        "custom_name": request.custom_name or "",
-        "creator_uid": request.creator_uid
+        "iv": metadata.iv,
+        "salt": metadata.salt,
+        "custom_name": metadata.custom_name or "",
+        "creator_uid": metadata.creator_uid
     }
     
     # Save to database
-    if not db.store_message(message_id, message_data):
+    if not await store(message_id, message_data):
         logger.error(f"Failed to store message {message_id}")
         raise HTTPException(status_code=500, detail="Failed to store message")
     
@@ -552,7 +624,7 @@ async def create_message(request: CreateMessageRequest):
     domain = os.getenv("DOMAIN", "localhost:8000")
     protocol = "https" if domain != "localhost:8000" else "http"
     
-    response_data = {
+    response_data: CreateMessageResponse = {
         "url": f"{protocol}://{domain}/",
         "view": message_id
     }
@@ -561,20 +633,59 @@ async def create_message(request: CreateMessageRequest):
     if idempotency_cache_key:
         store_idempotency(idempotency_cache_key, response_data)
 
-    return JSONResponse(response_data)
+    return TypedJSONResponse(CREATE_RESPONSE, response_data)
 
-@app.post("/api/view")
-async def view_message(request: ViewMessageRequest):
-    """Retrieve encrypted message"""
-    logger.info(f"Viewing message {request.view}")
-    
-    # Retrieve message from database
-    data = db.retrieve_message(request.view)
-    
+@app.post("/api/create", response_model=CreateMessageResponse)
+async def create_message(request: CreateMessageRequest):
+    """Create a new encrypted message"""
+    async def store(message_id: str, message_data: Dict[str, Any]) -> bool:
+        message_data["encrypted_message"] = request.encrypted_message
+        return await async_db.store_message(message_id, message_data)
+
+    return await create_secret(request, store)
+
+@app.post("/api/create-binary", response_model=CreateMessageResponse)
+async def create_message_binary(request: Request):
+    """Create a new encrypted message from a raw ciphertext body.
+
+    The body is the ciphertext as application/octet-stream and is streamed
+    into storage chunk by chunk; the other fields of /api/create travel as
+    JSON in the X-Secret-Metadata header. Responds like /api/create.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != "application/octet-stream":
+        raise HTTPException(status_code=415, detail="Expected application/octet-stream")
+    try:
+        size = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="Encrypted message cannot be empty")
+    if size > MAX_BINARY_MESSAGE_SIZE:
+        raise HTTPException(status_code=413, detail="Encrypted message too large")
+
+    try:
+        metadata = SecretMetadata.model_validate_json(request.headers.get(SECRET_METADATA_HEADER, ""))
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=e.errors(include_url=False, include_context=False, include_input=False),
+        )
+
+    async def store(message_id: str, message_data: Dict[str, Any]) -> bool:
+        return await async_db.store_message_stream(message_id, message_data, size, request.stream())
+
+    try:
+        return await create_secret(metadata, store)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def view_denied(request: ViewMessageRequest, data: Optional[Dict[str, Any]]) -> Optional[FastJSONResponse]:
+    """The 404/410/403 response for a view request, or None if access is granted"""
     # Check if message exists
     if not data:
         logger.warning(f"Message not found: {request.view}")
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=404,
             content={"message": "No such hash!", "redirect_root": "true"}
         )
@@ -583,7 +694,7 @@ async def view_message(request: ViewMessageRequest):
     current_time = get_timestamp()
     if data["ttl"] < current_time:
         logger.info(f"Message {request.view} has expired")
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=410,
             content={"message": "Message has expired!", "redirect_root": "true"}
         )
@@ -591,29 +702,70 @@ async def view_message(request: ViewMessageRequest):
     # Check access permissions
     if data["uid"] == "" or data["uid"] == request.uid:
         logger.info(f"Access granted for message {request.view}")
-
-        # Create response with only necessary fields, excluding sensitive uid and creator_uid
-        return {
-            "encrypted_message": data["encrypted_message"],
-            "iv": data["iv"],
-            "salt": data["salt"],
-            "custom_name": data.get("custom_name", ""),
-            "is_owner": data["uid"] == request.uid
-        }
+        return None
 
     logger.warning(f"Access denied for message {request.view}")
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=403,
         content={"message": "Access denied!", "redirect_root": "true"}
     )
 
-@app.post("/api/update")
+@app.post("/api/view", response_model=ViewMessageResponse)
+async def view_message(request: ViewMessageRequest):
+    """Retrieve encrypted message"""
+    logger.info(f"Viewing message {request.view}")
+    
+    # Retrieve message from database
+    data = await async_db.retrieve_message(request.view)
+    denied = view_denied(request, data)
+    if denied:
+        return denied
+
+    # Create response with only necessary fields, excluding sensitive uid and creator_uid
+    return TypedJSONResponse(VIEW_RESPONSE, {
+        "encrypted_message": blob_to_b64(data["encrypted_message"]),
+        "iv": blob_to_b64(data["iv"]),
+        "salt": blob_to_b64(data["salt"]),
+        "custom_name": data.get("custom_name", ""),
+        "is_owner": data["uid"] == request.uid
+    })
+
+@app.post("/api/view-binary")
+async def view_message_binary(request: ViewMessageRequest):
+    """Stream the raw ciphertext of a message.
+
+    Same access rules and error responses as /api/view. The body is the
+    ciphertext as application/octet-stream, sent chunk by chunk as it is
+    read; IV and salt (base64), custom name (percent-encoded) and
+    ownership travel in X-Secret-* headers. Legacy payloads still stored
+    as base64 TEXT get a 404 without redirect_root, which sends the
+    client to /api/view.
+    """
+    logger.info(f"Viewing message {request.view} (binary)")
+
+    opened = await async_db.open_message_stream(request.view)
+    data, chunks = opened if opened else (None, None)
+    denied = view_denied(request, data)
+    if denied:
+        return denied
+    if chunks is None:
+        return FastJSONResponse(status_code=404, content={"message": "Stored as text, use /api/view"})
+
+    return StreamingResponse(chunks, media_type="application/octet-stream", headers={
+        "Content-Length": str(data["payload_size"]),
+        "X-Secret-IV": blob_to_b64(data["iv"]),
+        "X-Secret-Salt": blob_to_b64(data["salt"]),
+        "X-Secret-Custom-Name": quote(data.get("custom_name") or ""),
+        "X-Secret-Is-Owner": "true" if data["uid"] == request.uid else "false",
+    })
+
+@app.post("/api/update", response_model=StatusResponse)
 async def update_owner(request: UpdateOwnerRequest):
     """Update message owner"""
     logger.info(f"Updating owner for message {request.view}")
 
     # Atomically update owner — SQL WHERE uid = '' prevents race conditions
-    result = db.update_message_owner(
+    result = await async_db.update_message_owner(
         request.view,
         request.uid,
         request.encrypted_message,
@@ -623,68 +775,75 @@ async def update_owner(request: UpdateOwnerRequest):
 
     if result["ok"]:
         logger.info(f"Successfully updated owner for message {request.view}")
-        return {"status": "success", "message": "secret owned"}
+        return TypedJSONResponse(STATUS_RESPONSE, {"status": "success", "message": "secret owned"})
 
     error = result.get("error", "not_found")
     status_map = {"not_found": 404, "already_owned": 409, "db_error": 503}
     message_map = {"not_found": "Secret not found", "already_owned": "Secret already owned", "db_error": "Service temporarily unavailable"}
     logger.warning(f"Ownership update failed for message {request.view}: {error}")
-    return JSONResponse(
+    return TypedJSONResponse(
+        STATUS_RESPONSE,
+        {"status": "failed", "message": message_map.get(error, "Secret not found or already owned")},
         status_code=status_map.get(error, 404),
-        content={"status": "failed", "message": message_map.get(error, "Secret not found or already owned")}
     )
 
-@app.post("/api/list-pending-secrets")
+@app.post("/api/list-pending-secrets", response_model=SecretListResponse)
 async def list_pending_secrets(request: ListSecretsRequest):
     """List user's pending secrets (created but not yet claimed)"""
     logger.info(f"Listing pending secrets")
     
-    result = db.list_pending_secrets(request.uid, request.page, request.per_page)
-    return result
+    result = await async_db.list_pending_secrets(
+        request.uid, request.page, request.per_page, request.cursor, request.include_total
+    )
+    return TypedJSONResponse(SECRET_LIST_RESPONSE, result)
 
-@app.post("/api/list-secrets")
+@app.post("/api/list-secrets", response_model=SecretListResponse)
 async def list_user_secrets(request: ListSecretsRequest):
     """List user's secrets with pagination"""
     logger.info(f"Listing user secrets")
     
-    result = db.list_user_secrets(request.uid, request.page, request.per_page)
-    return result
+    result = await async_db.list_user_secrets(
+        request.uid, request.page, request.per_page, request.cursor, request.include_total
+    )
+    return TypedJSONResponse(SECRET_LIST_RESPONSE, result)
 
-@app.post("/api/update-custom-name")
+@app.post("/api/update-custom-name", response_model=StatusResponse)
 async def update_custom_name(request: UpdateCustomNameRequest):
     """Update custom name for a secret"""
     logger.info(f"Updating custom name for secret {request.view}")
     
-    success = db.update_custom_name(request.view, request.uid, request.custom_name)
+    success = await async_db.update_custom_name(request.view, request.uid, request.custom_name)
 
     if success:
         logger.info(f"Successfully updated custom name for secret {request.view}")
-        return {"status": "success", "message": "Custom name updated"}
+        return TypedJSONResponse(STATUS_RESPONSE, {"status": "success", "message": "Custom name updated"})
     else:
         logger.warning(f"Failed to update custom name for secret {request.view}")
-        return JSONResponse(
+        return TypedJSONResponse(
+            STATUS_RESPONSE,
+            {"status": "failed", "message": "Secret not found or access denied"},
             status_code=404,
-            content={"status": "failed", "message": "Secret not found or access denied"}
         )
 
-@app.post("/api/delete-secret")
+@app.post("/api/delete-secret", response_model=StatusResponse)
 async def delete_secret(request: DeleteSecretRequest):
     """Delete a secret"""
     logger.info(f"Deleting secret {request.view}")
     
-    result = db.delete_message(request.view, request.uid)
+    result = await async_db.delete_message(request.view, request.uid)
 
     if result["ok"]:
         logger.info(f"Successfully deleted secret {request.view}")
-        return {"status": "success", "message": "Secret deleted"}
+        return TypedJSONResponse(STATUS_RESPONSE, {"status": "success", "message": "Secret deleted"})
 
     error = result.get("error", "not_found")
     status = 503 if error == "db_error" else 404
     message = "Service temporarily unavailable" if error == "db_error" else "Secret not found or access denied"
     logger.warning(f"Failed to delete secret {request.view}: {error}")
-    return JSONResponse(
+    return TypedJSONResponse(
+        STATUS_RESPONSE,
+        {"status": "failed", "message": message},
         status_code=status,
-        content={"status": "failed", "message": message}
     )
 
 @app.get("/health")
@@ -692,10 +851,17 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 # Mount static files after all routes are defined
-app.mount("/templates-modular", StaticFiles(directory="templates-modular"), name="static")
+app.mount("/templates-modular", AssetStaticFiles(directory="templates-modular"), name="static")
 
 if __name__ == "__main__":
+    # Page templates are prebuilt with `python -m template_cache build`,
+    # which does not import this module (and so never opens the database)
     logger.info("Starting Inigma server")
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info", log_config=UVICORN_LOG_CONFIG)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms keep one small list per label combination and are
+updated under a per-metric lock, so recording costs a dict lookup and a
+bisect. Values that other components already track (cache, sweeper and
+logging counters) are read through callbacks at scrape time and cost
+nothing in between.
+"""
+import asyncio
+import math
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Seconds; covers cached reads (sub-millisecond) up to slow 2 MB transfers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    """Base class: name, help text, type and label names"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        """(name, labels, value) for every series of this metric"""
+
+
+class Counter(Metric):
+    """Monotonic counter per label combination"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield self.name + "_total", tuple(zip(self.labelnames, labelvalues)), value
+
+
+class Histogram(Metric):
+    """Bucketed distribution per label combination.
+
+    Each series is [count per bucket..., count above the last bucket, sum];
+    buckets are made cumulative only when rendered.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect_left(self.buckets, value)  # first bucket with value <= bound
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            series_list = [(labelvalues, list(series)) for labelvalues, series in self._series.items()]
+        for labelvalues, series in series_list:
+            labels = tuple(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                yield self.name + "_bucket", labels + (("le", _format_value(bound)),), cumulative
+            yield self.name + "_sum", labels, series[-1]
+            yield self.name + "_count", labels, cumulative
+
+
+class CallbackMetric(Metric):
+    """Counter or gauge whose value is read from ``func`` at scrape time.
+
+    ``func`` returns a number, or a dict of label-value tuples to numbers
+    when the metric has labels. Counter names get the ``_total`` suffix.
+    """
+    def __init__(self, name: str, documentation: str, kind: str,
+                 func: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.func = func
+
+    def samples(self) -> Iterator[Sample]:
+        name = self.name + "_total" if self.kind == "counter" else self.name
+        value = self.func()
+        if isinstance(value, dict):
+            for labelvalues, v in value.items():
+                yield name, tuple(zip(self.labelnames, labelvalues)), v
+        else:
+            yield name, (), value
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them for a scrape"""
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str,
+                 func: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+                 labelnames: Sequence[str] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, kind, func, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a timer scheduled ``interval`` ahead.
+
+    A busy or blocked loop wakes the monitor late; the delay is recorded in
+    ``histogram`` and the latest value is kept in ``last_lag``.
+    """
+    def __init__(self, histogram: Histogram, interval: float = 0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start measuring on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(self.last_lag)
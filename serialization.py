@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""JSON encoding shared by API responses and structured logs.
+
+``json_dumps`` is orjson when it is installed and pydantic-core's Rust
+encoder otherwise; both emit compact UTF-8 bytes. API responses with a
+declared schema are serialized straight from the handler's dict by the
+schema's compiled serializer, skipping FastAPI's jsonable_encoder pass.
+"""
+from typing import Any, Callable, Mapping, Optional
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # optional, pydantic-core is always available
+    orjson = None
+
+if orjson is not None:
+    json_dumps: Callable[[Any], bytes] = orjson.dumps
+    JSON_ENCODER = "orjson"
+else:
+    json_dumps = to_json
+    JSON_ENCODER = "pydantic-core"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with json_dumps instead of the stdlib encoder"""
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
+
+
+class TypedJSONResponse(FastJSONResponse):
+    """JSON response serialized by a declared schema's compiled serializer.
+
+    ``schema`` is a TypeAdapter over the response TypedDict. Content is not
+    validated, only serialized, so handlers must build it to the schema.
+    """
+    def __init__(self, schema: TypeAdapter, content: Any, status_code: int = 200,
+                 headers: Optional[Mapping[str, str]] = None):
+        self.schema = schema
+        super().__init__(content, status_code=status_code, headers=headers)
+
+    def render(self, content: Any) -> bytes:
+        return self.schema.dump_json(content)
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import stat
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # optional: only needed to emit .br variants at build time
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = "templates-modular"
+NONCE_PLACEHOLDER = "__CSP_NONCE__"
+PAGES = ("index.html", "view.html")
+
+# Output of `python -m template_cache build`: resolved pages + manifest.json
+TEMPLATE_BUILD_DIR = "templates-build"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Content-hashed scripts/styles emitted by the build, served from the static mount
+ASSETS_DIR = f"{TEMPLATES_DIR}/assets"
+ASSETS_URL_PREFIX = "/templates-modular/assets/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+TEMPLATE_NAME_REGEX = re.compile(r'^[a-zA-Z0-9_-]+\.html$')
+INCLUDE_REGEX = re.compile(r'\{\{>\s*([^}]+)\s*\}\}')
+MAX_INCLUDE_DEPTH = 10
+
+# <stem>.<16 hex content hash>.<ext>[.gz|.br] as written by AssetBundler
+HASHED_ASSET_REGEX = re.compile(r'\.([0-9a-f]{16})\.[a-z]+(\.gz|\.br)?$')
+
+# Inline blocks whose body is nothing but script/style includes. These are
+# the blocks the asset pipeline can move into external files unchanged.
+SCRIPT_BLOCK_REGEX = re.compile(
+    r'<script nonce="__CSP_NONCE__">\s*((?:\{\{>\s*[^}]+?\.js\s*\}\}\s*)+)</script>'
+)
+STYLE_BLOCK_REGEX = re.compile(
+    r'<style>\s*((?:\{\{>\s*[^}]+?\.css\s*\}\}\s*)+)</style>'
+)
+
+
+def resolve_include_path(filename: str) -> str:
+    """Map an include name to its file under templates-modular"""
+    if filename.endswith('.css'):
+        return f"{TEMPLATES_DIR}/styles/{filename}"
+    if filename.endswith('.js'):
+        return f"{TEMPLATES_DIR}/scripts/{filename}"
+    # HTML component
+    return f"{TEMPLATES_DIR}/components/{filename}.html"
+
+
+def build_template_from_modular(template_name: str, dependencies: Optional[List[str]] = None,
+                                assets: Optional["AssetBundler"] = None) -> str:
+    """Build template from modular components.
+
+    If ``dependencies`` is given, the path of every file the page is built
+    from (page, includes and nested includes, including missing ones) is
+    appended to it. If ``assets`` is given, inline script/style include
+    blocks are written out as hashed files and referenced instead.
+    """
+    # Defense-in-depth against path traversal: only allow plain *.html names.
+    if not TEMPLATE_NAME_REGEX.match(template_name):
+        raise ValueError(f"Invalid template name: {template_name}")
+
+    template_path = f"{TEMPLATES_DIR}/pages/{template_name}"
+
+    if not os.path.exists(template_path):
+        raise FileNotFoundError(f"Template not found: {template_path}")
+
+    if dependencies is not None:
+        dependencies.append(template_path)
+
+    with open(template_path, 'r') as f:
+        content = f.read()
+
+    # Process {{> filename }} includes
+    def replace_include(match):
+        filename = match.group(1).strip()
+        file_path = resolve_include_path(filename)
+        if dependencies is not None:
+            dependencies.append(file_path)
+
+        if not os.path.exists(file_path):
+            logger.warning(f"Include file not found: {file_path}")
+            return f"<!-- Missing: {filename} -->"
+
+        with open(file_path, 'r') as f:
+            return f.read()
+
+    # Recursively resolve includes until none remain (max 10 levels)
+    for _ in range(MAX_INCLUDE_DEPTH):
+        if assets is not None:
+            content = assets.externalize(content, dependencies)
+        new_content = INCLUDE_REGEX.sub(replace_include, content)
+        if new_content == content:
+            break
+        content = new_content
+
+    return content
+
+
+class AssetBundler:
+    """Moves inline script/style include blocks into content-hashed files.
+
+    Every included file becomes ``<name>.<hash>.<ext>`` under ``output_dir``
+    (so files shared by several pages are cached once), with ``.gz`` (and
+    ``.br`` when the brotli module is installed) siblings written next to
+    it. Scripts gain an SRI hash and drop their nonce: they are same-origin,
+    so the CSP's 'self' covers them, and a page without inline scripts has
+    no nonce in its body and can be revalidated (see CompiledPage.etag).
+    """
+
+    def __init__(self, output_dir: str = ASSETS_DIR, url_prefix: str = ASSETS_URL_PREFIX):
+        self.output_dir = output_dir
+        self.url_prefix = url_prefix
+        self.assets: Dict[str, Dict[str, Any]] = {}
+
+    def externalize(self, content: str, dependencies: Optional[List[str]] = None) -> str:
+        """Replace every bundleable block in ``content`` with external references"""
+        def script_tags(match):
+            tags = []
+            for name in INCLUDE_REGEX.findall(match.group(1)):
+                asset = self.asset(name.strip(), dependencies)
+                if asset is None:
+                    tags.append(f"<!-- Missing: {name.strip()} -->")
+                else:
+                    url, integrity = asset
+                    tags.append(
+                        f'<script src="{url}" integrity="{integrity}"></script>'
+                    )
+            return "\n".join(tags)
+
+        def style_tags(match):
+            tags = []
+            for name in INCLUDE_REGEX.findall(match.group(1)):
+                asset = self.asset(name.strip(), dependencies)
+                if asset is None:
+                    tags.append(f"<!-- Missing: {name.strip()} -->")
+                else:
+                    url, integrity = asset
+                    tags.append(f'<link rel="stylesheet" href="{url}" integrity="{integrity}">')
+            return "\n".join(tags)
+
+        content = SCRIPT_BLOCK_REGEX.sub(script_tags, content)
+        return STYLE_BLOCK_REGEX.sub(style_tags, content)
+
+    def asset(self, name: str, dependencies: Optional[List[str]] = None) -> Optional[Tuple[str, str]]:
+        """Emit one included file as a hashed asset; return (url, integrity)"""
+        file_path = resolve_include_path(name)
+        if dependencies is not None:
+            dependencies.append(file_path)
+        if not os.path.exists(file_path):
+            logger.warning(f"Include file not found: {file_path}")
+            return None
+
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:16]}{ext}"
+        integrity = "sha384-" + base64.b64encode(hashlib.sha384(data).digest()).decode("ascii")
+
+        if filename not in self.assets:
+            self._write(filename, data)
+            self.assets[filename] = {
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "integrity": integrity,
+                "size": len(data),
+                "source": file_path,
+            }
+        return self.url_prefix + filename, integrity
+
+    def _write(self, filename: str, data: bytes):
+        """Write an asset and its precompressed variants"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        # mtime=0 keeps the .gz output byte-for-byte reproducible
+        with open(path + ".gz", 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+
+
+def _accepted_encodings(accept_encoding: str) -> List[str]:
+    """Parse an Accept-Encoding header into the codings with a non-zero q-value"""
+    accepted = []
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.append(coding.strip().lower())
+    return accepted
+
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles mount that serves hashed build assets efficiently.
+
+    Files under ``assets/`` have content hashes in their names, so they are
+    sent with an immutable Cache-Control and, when the client accepts it,
+    from the precompressed ``.br``/``.gz`` sibling written at build time.
+    """
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # full path -> (mtime_ns, size, etag) for files without a hash in their name
+        self._etags: Dict[str, Tuple[int, int, str]] = {}
+
+    def content_etag(self, full_path: str, stat_result: os.stat_result) -> str:
+        """Strong ETag derived from file content rather than mtime/size"""
+        match = HASHED_ASSET_REGEX.search(full_path)
+        if match:
+            # Hashed assets carry their digest in the name; each encoding is
+            # a different representation and needs its own validator.
+            return f'"{match.group(1)}{match.group(2) or ""}"'
+
+        cached = self._etags.get(full_path)
+        if cached and cached[0] == stat_result.st_mtime_ns and cached[1] == stat_result.st_size:
+            return cached[2]
+        with open(full_path, 'rb') as f:
+            etag = f'"{hashlib.sha256(f.read()).hexdigest()[:32]}"'
+        self._etags[full_path] = (stat_result.st_mtime_ns, stat_result.st_size, etag)
+        return etag
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["ETag"] = self.content_etag(str(full_path), stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if not path.startswith("assets/") or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        response = None
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        for coding, suffix in self.ENCODINGS:
+            if coding not in accepted:
+                continue
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                response = self.file_response(full_path, stat_result, scope)
+                if response.status_code != 304:
+                    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                    response.headers["Content-Type"] = media_type
+                    response.headers["Content-Encoding"] = coding
+                break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+def _file_mtime(path: str) -> Optional[int]:
+    """Return the file's mtime in ns, or None if it does not exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class CompiledPage:
+    """A fully assembled page, pre-split at the CSP nonce placeholders.
+
+    Rendering is a single bytes join, so its cost does not depend on how
+    many components the page includes.
+    """
+
+    __slots__ = ("name", "segments", "dependencies", "shell_etag")
+
+    def __init__(self, name: str, content: str, dependencies: Optional[Dict[str, Optional[int]]] = None):
+        self.name = name
+        self.segments: Tuple[bytes, ...] = tuple(
+            part.encode("utf-8") for part in content.split(NONCE_PLACEHOLDER)
+        )
+        # Source path -> mtime at build time (None if the file was missing)
+        self.dependencies = dependencies or {}
+        # Validator for the nonce-independent shell
+        self.shell_etag = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+    def render(self, nonce: str) -> bytes:
+        """Splice a fresh nonce into every placeholder position"""
+        return nonce.encode("ascii").join(self.segments)
+
+    @property
+    def etag(self) -> Optional[str]:
+        """Strong ETag, or None if the page embeds the per-response nonce.
+
+        Only a page whose body is the same for every response can be
+        revalidated: a cached copy carrying an old nonce would otherwise need
+        a CSP authorizing that (client-supplied) nonce again.
+        """
+        if len(self.segments) > 1:
+            return None
+        return f'"{self.shell_etag}"'
+
+    def not_modified(self, if_none_match: str) -> bool:
+        """True if ``if_none_match`` lists this page's current ETag"""
+        etag = self.etag
+        if etag is None:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag in tags or f"W/{etag}" in tags or "*" in tags
+
+    def is_stale(self) -> bool:
+        """Check whether any source file changed since the page was built"""
+        return any(_file_mtime(path) != mtime for path, mtime in self.dependencies.items())
+
+
+class TemplateCache:
+    """In-memory cache of compiled pages, built once at startup.
+
+    With ``reload`` enabled (development only), every render stats the
+    files the page was built from and rebuilds just that page when one of
+    them changed. Production keeps the zero-I/O path.
+    """
+
+    def __init__(self, pages: Iterable[str] = PAGES, reload: bool = False):
+        self.page_names = tuple(pages)
+        self.reload = reload
+        self._pages: Dict[str, CompiledPage] = {}
+
+    def compile_page(self, name: str) -> CompiledPage:
+        """(Re)build a single page from the modular sources"""
+        paths: List[str] = []
+        content = build_template_from_modular(name, dependencies=paths)
+        dependencies = {path: _file_mtime(path) for path in paths} if self.reload else None
+        page = CompiledPage(name, content, dependencies)
+        self._pages[name] = page
+        return page
+
+    def compile_all(self):
+        """Build every known page"""
+        for name in self.page_names:
+            self.compile_page(name)
+        logger.info(f"Compiled {len(self._pages)} page templates (reload={'on' if self.reload else 'off'})")
+
+    def write_build(self, output_dir: str = TEMPLATE_BUILD_DIR,
+                    assets_dir: Optional[str] = ASSETS_DIR) -> Dict[str, Any]:
+        """Resolve every page from sources and write them plus a manifest.
+
+        Pages keep their nonce placeholders; the manifest records a SHA-256
+        of each file so a truncated or stale artifact is never served. When
+        ``assets_dir`` is set, inline scripts and styles are emitted there as
+        hashed files (see AssetBundler); pass None to keep them inline.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "pages": {}, "assets": {}}
+
+        assets = None
+        if assets_dir is not None:
+            # The directory only ever holds build output; drop stale hashes
+            shutil.rmtree(assets_dir, ignore_errors=True)
+            assets = AssetBundler(assets_dir)
+
+        for name in self.page_names:
+            paths: List[str] = []
+            data = build_template_from_modular(name, dependencies=paths, assets=assets).encode("utf-8")
+            with open(os.path.join(output_dir, name), 'wb') as f:
+                f.write(data)
+            manifest["pages"][name] = {
+                "file": name,
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "size": len(data),
+                "sources": sorted(set(paths)),
+            }
+
+        if assets is not None:
+            manifest["assets"] = assets.assets
+
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        logger.info(
+            f"Wrote {len(manifest['pages'])} prebuilt page templates to {output_dir} "
+            f"({len(manifest['assets'])} external assets)"
+        )
+        return manifest
+
+    def load_build(self, build_dir: str = TEMPLATE_BUILD_DIR) -> bool:
+        """Load prebuilt pages from a build directory.
+
+        Returns False (leaving the cache untouched) if there is no usable
+        build, so the caller can fall back to compiling from sources.
+        """
+        manifest_path = os.path.join(build_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return False
+
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"unsupported manifest version {manifest.get('version')}")
+
+            pages: Dict[str, CompiledPage] = {}
+            for name in self.page_names:
+                entry = manifest["pages"][name]
+                if not TEMPLATE_NAME_REGEX.match(entry["file"]):
+                    raise ValueError(f"invalid page file name {entry['file']}")
+                with open(os.path.join(build_dir, entry["file"]), 'rb') as f:
+                    data = f.read()
+                if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+                    raise ValueError(f"checksum mismatch for {name}")
+                pages[name] = CompiledPage(name, data.decode("utf-8"))
+        except Exception as e:
+            logger.error(f"Ignoring prebuilt templates in {build_dir}: {e}")
+            return False
+
+        # Sources edited after the build are not picked up; say so rather
+        # than silently serving the old pages
+        built_at = os.stat(manifest_path).st_mtime_ns
+        stale = sorted({
+            path for entry in manifest["pages"].values() for path in entry.get("sources", [])
+            if (_file_mtime(path) or 0) > built_at
+        })
+        if stale:
+            logger.warning(
+                f"Template sources changed since the build in {build_dir} and will not be served "
+                f"until it is rebuilt: {', '.join(stale)}"
+            )
+
+        self._pages.update(pages)
+        logger.info(f"Loaded {len(pages)} prebuilt page templates from {build_dir}")
+        return True
+
+    def load(self, build_dir: str = TEMPLATE_BUILD_DIR):
+        """Populate the cache at startup.
+
+        Prebuilt artifacts win when present; reload mode always compiles
+        from sources so that edits are tracked.
+        """
+        if not self.reload and self.load_build(build_dir):
+            return
+        self.compile_all()
+
+    def get(self, name: str) -> CompiledPage:
+        """Return the compiled page, building it on first use if needed"""
+        page: Optional[CompiledPage] = self._pages.get(name)
+        if page is None:
+            page = self.compile_page(name)
+        elif self.reload and page.is_stale():
+            logger.info(f"Template sources for {name} changed, rebuilding")
+            page = self.compile_page(name)
+        return page
+
+    def render(self, name: str, nonce: str) -> bytes:
+        """Render a compiled page with the given CSP nonce"""
+        return self.get(name).render(nonce)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-assemble Inigma page templates")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--output", default=os.getenv("TEMPLATE_BUILD_DIR", TEMPLATE_BUILD_DIR),
+                        help="Output directory for the resolved pages and manifest")
+    parser.add_argument("--inline-assets", action="store_true",
+                        help="Keep scripts and styles inline instead of emitting hashed asset files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    TemplateCache().write_build(args.output, assets_dir=None if args.inline_assets else ASSETS_DIR)
+
+
+if __name__ == "__main__":
+    main()
@@ -48,21 +48,12 @@ document.addEventListener('alpine:init', () => {
             }
             
             try {
-                const response = await fetch('/api/view', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ view, uid })
-                });
-                
-                const data = await response.json();
-                
-                if (data.redirect_root === 'true') {
-                    this.showError(data.message);
+                const loaded = await this.fetchMessage(view, uid);
+                if (!loaded) {
                     return;
                 }
-                
-                this.messageData = data;
-                this.isOwner = data.is_owner;
+                this.messageData = loaded.messageData;
+                this.isOwner = loaded.isOwner;
                 
                 // Try to decrypt
                 if (urlKey) {
@@ -93,11 +84,61 @@ document.addEventListener('alpine:init', () => {
         },
         
         
+        // Raw ciphertext from /api/view-binary, IV/salt/ownership in headers.
+        // Backends without that route (the Workers deployment) answer 404
+        // without redirect_root; those fall back to the base64 /api/view.
+        // Returns null once an error has been shown.
+        async fetchMessage(view, uid) {
+            const request = {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ view, uid })
+            };
+            let response = await fetch('/api/view-binary', request);
+            let binary = true;
+            if (response.status === 404) {
+                const data = await response.json().catch(() => ({}));
+                if (data.redirect_root === 'true') {
+                    this.showError(data.message);
+                    return null;
+                }
+                response = await fetch('/api/view', request);
+                binary = false;
+            }
+            
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                if (data.redirect_root === 'true') {
+                    this.showError(data.message);
+                    return null;
+                }
+                throw new Error(`HTTP ${response.status}`);
+            }
+            
+            if (!binary) {
+                const data = await response.json();
+                return {
+                    messageData: {
+                        encrypted: base64ToArrayBuffer(data.encrypted_message),
+                        iv: base64ToArrayBuffer(data.iv),
+                        salt: base64ToArrayBuffer(data.salt)
+                    },
+                    isOwner: data.is_owner
+                };
+            }
+            return {
+                messageData: {
+                    encrypted: await response.arrayBuffer(),
+                    iv: base64ToArrayBuffer(response.headers.get('X-Secret-IV')),
+                    salt: base64ToArrayBuffer(response.headers.get('X-Secret-Salt'))
+                },
+                isOwner: response.headers.get('X-Secret-Is-Owner') === 'true'
+            };
+        },
+        
         async decryptMessage(password) {
             try {
-                const encrypted = base64ToArrayBuffer(this.messageData.encrypted_message);
-                const iv = base64ToArrayBuffer(this.messageData.iv);
-                const salt = base64ToArrayBuffer(this.messageData.salt);
+                const { encrypted, iv, salt } = this.messageData;
                 
                 const decrypted = await decrypt(encrypted, salt, iv, password);
                 this.decryptedMessage = new TextDecoder().decode(decrypted);
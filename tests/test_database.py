@@ -0,0 +1,234 @@
+"""
+Database layer tests: write lock contention, message cache invalidation
+and the message id filter.
+
+Like test_expiry.py these need no Docker; they drive DatabaseManager on a
+temporary SQLite file.
+Run with: pytest tests/test_database.py -v
+"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from database import PERMANENT_TTL, DatabaseManager, MessageCache, MessageIdFilter
+
+
+def _message(ttl=PERMANENT_TTL, uid=""):
+    return {
+        "ttl": ttl,
+        "uid": uid,
+        "encrypted_message": "c2VjcmV0",
+        "iv": "AAAAAAAAAAAAAAAA",
+        "salt": "AAAAAAAAAAAAAAAAAAAAAA==",
+        "creator_uid": "alice",
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "inigma.db"
+
+
+@pytest.fixture
+def db(db_path):
+    manager = DatabaseManager(db_path)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def locked(db_path):
+    """Another connection holding the write lock; call locked.release() to free it"""
+    DatabaseManager(db_path).close()  # create the schema first
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+
+    class Lock:
+        @staticmethod
+        def release():
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    yield Lock
+    Lock.release()
+    conn.close()
+
+
+# ---------------------------------------------------------------------------
+# SQLITE_BUSY retry with backoff
+# ---------------------------------------------------------------------------
+
+class TestBusyRetry:
+    def test_uncontended_write_is_not_retried(self, db_path):
+        db = DatabaseManager(db_path)
+        assert db.store_message("free", _message())
+        stats = db.write_lock_stats()
+        assert stats["transactions"] == 1
+        assert stats["busy_retries"] == 0
+        assert stats["busy_failures"] == 0
+        db.close()
+
+    def test_gives_up_after_busy_retries(self, db_path, locked):
+        db = DatabaseManager(db_path, busy_timeout_ms=10, busy_retries=3,
+                             busy_backoff=0.01, busy_backoff_max=0.02)
+        started = time.monotonic()
+        assert db.store_message("blocked", _message()) is False
+        elapsed = time.monotonic() - started
+
+        stats = db.write_lock_stats()
+        assert stats["busy_retries"] == 3
+        assert stats["busy_failures"] == 1
+        assert stats["transactions"] == 0
+        # Four busy_timeout waits plus at most three capped backoffs
+        assert stats["lock_wait_seconds_total"] >= 4 * 0.01 * 0.5
+        assert 0 < stats["backoff_seconds_total"] <= 3 * 0.02
+        assert elapsed < 2
+        db.close()
+
+    def test_write_succeeds_once_lock_is_released(self, db_path, locked):
+        db = DatabaseManager(db_path, busy_timeout_ms=10, busy_retries=50,
+                             busy_backoff=0.005, busy_backoff_max=0.02)
+        timer = threading.Timer(0.1, locked.release)
+        timer.start()
+        try:
+            assert db.store_message("waited", _message())
+        finally:
+            timer.join()
+
+        stats = db.write_lock_stats()
+        assert stats["busy_retries"] >= 1
+        assert stats["busy_failures"] == 0
+        assert stats["transactions"] == 1
+        assert stats["lock_wait_max_seconds"] > 0
+        assert db.retrieve_message("waited")["encrypted_message"] == b"secret"
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# Message cache generation and invalidation
+# ---------------------------------------------------------------------------
+
+class TestCacheInvalidation:
+    def test_stale_put_after_invalidation_is_dropped(self):
+        cache = MessageCache()
+        message = {"ttl": PERMANENT_TTL, "encrypted_message": b"old", "iv": b"", "salt": b""}
+        generation = cache.generation
+        cache.invalidate("m1")
+        assert cache.generation == generation + 1
+
+        # A reader that loaded before the invalidation must not cache its row
+        cache.put("m1", message, generation)
+        assert cache.get("m1") is None
+        cache.put("m1", message, cache.generation)
+        assert cache.get("m1")["encrypted_message"] == b"old"
+
+    def test_update_invalidates_cached_message(self, db):
+        assert db.store_message("m1", _message(uid="bob"))
+        assert db.retrieve_message("m1")["custom_name"] == ""
+        assert db.cache.stats()["entries"] == 1
+
+        generation = db.cache.generation
+        assert db.update_custom_name("m1", "bob", "wifi")
+        assert db.cache.generation == generation + 1
+        assert db.cache.stats()["invalidations"] == 1
+        assert db.retrieve_message("m1")["custom_name"] == "wifi"
+
+    def test_store_only_batch_keeps_cache(self, db):
+        assert db.store_message("cached", _message())
+        db.retrieve_message("cached")
+
+        generation = db.cache.generation
+        results = db.write_batch([("store_message", (f"new-{i}", _message())) for i in range(3)])
+        assert results == [True, True, True]
+        assert db.cache.generation == generation
+        assert db.cache.get("cached") is not None
+
+    def test_mixed_batch_invalidates_changed_ids_only(self, db):
+        for message_id in ("kept", "renamed", "deleted"):
+            assert db.store_message(message_id, _message(uid="bob"))
+            db.retrieve_message(message_id)
+
+        generation = db.cache.generation
+        results = db.write_batch([
+            ("store_message", ("new", _message())),
+            ("update_custom_name", ("renamed", "bob", "wifi")),
+            ("delete_message", ("deleted", "bob")),
+        ])
+        assert results[:2] == [True, True] and results[2]["ok"]
+        assert db.cache.generation == generation + 1
+        assert db.cache.get("kept") is not None
+        assert db.cache.get("renamed") is None
+        assert db.cache.get("deleted") is None
+        assert db.retrieve_message("renamed")["custom_name"] == "wifi"
+        assert db.retrieve_message("deleted") is None
+
+
+# ---------------------------------------------------------------------------
+# Message id filter (counting Bloom filter)
+# ---------------------------------------------------------------------------
+
+class TestMessageIdFilter:
+    def test_add_and_remove(self):
+        id_filter = MessageIdFilter(100)
+        assert not id_filter.might_contain("m1")
+        id_filter.add("m1")
+        id_filter.add("m2")
+        assert id_filter.might_contain("m1") and id_filter.might_contain("m2")
+        assert id_filter.count == 2
+
+        id_filter.remove("m1")
+        assert not id_filter.might_contain("m1")
+        assert id_filter.might_contain("m2")
+        assert id_filter.count == 1
+
+    def test_saturated_counters_are_never_decremented(self):
+        id_filter = MessageIdFilter(100)
+        for _ in range(300):
+            id_filter.add("hot")
+        for _ in range(300):
+            id_filter.remove("hot")
+        # A stale positive, never a false negative for ids sharing those slots
+        assert id_filter.might_contain("hot")
+        assert id_filter.count == 0
+
+    def test_false_positive_rate_at_capacity(self):
+        id_filter = MessageIdFilter(2000, fp_rate=0.01)
+        for i in range(2000):
+            id_filter.add(f"live-{i}")
+        assert all(id_filter.might_contain(f"live-{i}") for i in range(2000))
+
+        estimated = id_filter.estimated_fp_rate()
+        assert 0.005 < estimated < 0.02
+        false_positives = sum(id_filter.might_contain(f"absent-{i}") for i in range(20000))
+        assert false_positives / 20000 < 2 * estimated
+
+    def test_may_exist_counts_checks_and_misses(self, db):
+        assert db.store_message("stored", _message(uid="bob"))
+        assert db.may_exist("stored")
+        assert not db.may_exist("never-stored")
+
+        stats = db.id_filter_stats()
+        assert stats["ids"] == 1
+        assert stats["checks"] == 2
+        assert stats["definite_misses"] == 1
+
+        assert db.delete_message("stored", "bob")["ok"]
+        assert not db.may_exist("stored")
+        assert db.id_filter_stats()["ids"] == 0
+
+    def test_rebuild_once_over_capacity(self, db_path):
+        db = DatabaseManager(db_path, id_filter_capacity=4)
+        for i in range(5):
+            assert db.store_message(f"m{i}", _message())
+        assert db.maintain_id_filter()
+
+        stats = db.id_filter_stats()
+        assert stats["rebuilds"] == 2  # once at startup, once now
+        assert stats["capacity"] == 10
+        assert stats["ids"] == 5
+        assert all(db.may_exist(f"m{i}") for i in range(5))
+        assert not db.maintain_id_filter()
+        db.close()
@@ -0,0 +1,150 @@
+"""
+Expiry lifecycle tests for the database layer.
+
+Unlike test_integration.py these need no Docker: they drive DatabaseManager
+and ExpirySweeper on a temporary SQLite file and fake the clock by patching
+time.time.
+Run with: pytest tests/test_expiry.py -v
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from database import (
+    PARTITION_SECONDS,
+    PERMANENT_TTL,
+    AsyncDatabaseManager,
+    DatabaseManager,
+    ExpirySweeper,
+    payload_partition,
+)
+
+
+def _message(ttl):
+    return {
+        "ttl": ttl,
+        "encrypted_message": "c2VjcmV0",
+        "iv": "AAAAAAAAAAAAAAAA",
+        "salt": "AAAAAAAAAAAAAAAAAAAAAA==",
+        "creator_uid": "alice",
+    }
+
+
+def _tables(db):
+    with db.get_connection() as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake time.time(), starting one hour into a UTC day; set clock.now to move it"""
+    class Clock:
+        now = (int(time.time()) // PARTITION_SECONDS) * PARTITION_SECONDS + 3600
+
+    monkeypatch.setattr(time, "time", lambda: Clock.now)
+    return Clock
+
+
+@pytest.fixture
+def db(tmp_path, clock):
+    manager = DatabaseManager(tmp_path / "inigma.db")
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def sweeper(db):
+    async_db = AsyncDatabaseManager(db)
+    yield ExpirySweeper(async_db)
+    async_db.close()
+
+
+# ---------------------------------------------------------------------------
+# Store → expire → sweep → partition drop
+# ---------------------------------------------------------------------------
+
+class TestExpiryLifecycle:
+    def test_store_expire_sweep_drop(self, db, clock, sweeper):
+        expiring_ttl = clock.now + 600
+        later_ttl = clock.now + 3 * PARTITION_SECONDS
+        assert db.store_message("expiring", _message(expiring_ttl))
+        assert db.store_message("later", _message(later_ttl))
+        assert db.store_message("permanent", _message(PERMANENT_TTL))
+
+        expiring_table = payload_partition(expiring_ttl)
+        assert {expiring_table, payload_partition(later_ttl)} <= _tables(db)
+
+        # Not expired yet: the sweep deletes nothing
+        assert asyncio.run(sweeper.sweep()) == 0
+        assert db.retrieve_message("expiring") is not None
+
+        # Expired, but its day has not passed: metadata goes, the partition stays
+        clock.now = expiring_ttl + 1
+        assert asyncio.run(sweeper.sweep()) == 1
+        assert db.retrieve_message("expiring") is None
+        assert sweeper.stats()["partitions_dropped_total"] == 0
+        assert expiring_table in _tables(db)
+
+        # The next day the whole partition is dropped
+        clock.now = (expiring_ttl // PARTITION_SECONDS + 1) * PARTITION_SECONDS + 1
+        asyncio.run(sweeper.sweep())
+        assert sweeper.stats()["partitions_dropped_total"] == 1
+        assert expiring_table not in _tables(db)
+
+        # Later and permanent messages survive with their ciphertext
+        for message_id in ("later", "permanent"):
+            message = db.retrieve_message(message_id)
+            assert message is not None
+            assert message["encrypted_message"] == b"secret"
+
+        # Even far in the future the permanent message is never swept
+        clock.now = later_ttl + 10 * PARTITION_SECONDS
+        asyncio.run(sweeper.sweep())
+        assert db.retrieve_message("later") is None
+        assert db.retrieve_message("permanent")["encrypted_message"] == b"secret"
+        assert "message_payloads" in _tables(db)
+
+
+# ---------------------------------------------------------------------------
+# List totals while expired rows wait for the sweeper
+# ---------------------------------------------------------------------------
+
+class TestListTotals:
+    def _store(self, db, clock):
+        for i in range(3):
+            assert db.store_message(f"expiring-{i}", _message(clock.now + 600))
+        for i in range(2):
+            assert db.store_message(f"live-{i}", _message(clock.now + 3 * PARTITION_SECONDS))
+        clock.now += 601  # expired, not swept
+
+    def test_single_page_reports_live_total(self, db, clock):
+        self._store(db, clock)
+        result = db.list_pending_secrets("alice")
+        assert [s["id"] for s in result["secrets"]] == ["live-1", "live-0"]
+        assert result["total"] == 2
+
+    def test_last_offset_page_reports_live_total(self, db, clock):
+        self._store(db, clock)
+        first = db.list_pending_secrets("alice", page=1, per_page=1)
+        assert first["has_more"]
+        assert first["total"] == 5  # counter still includes the expired rows
+        last = db.list_pending_secrets("alice", page=2, per_page=1)
+        assert not last["has_more"]
+        assert last["total"] == 2
+        # Past the end the live rows are counted
+        assert db.list_pending_secrets("alice", page=3, per_page=1)["total"] == 2
+
+    def test_last_cursor_page_reports_live_total(self, db, clock):
+        self._store(db, clock)
+        assert db.list_pending_secrets("alice", cursor="", per_page=5)["total"] == 2
+        first = db.list_pending_secrets("alice", cursor="", per_page=1)
+        last = db.list_pending_secrets("alice", cursor=first["next_cursor"], per_page=1)
+        assert not last["has_more"]
+        assert last["total"] == 2
+
+    def test_sweep_brings_counter_in_line(self, db, clock, sweeper):
+        self._store(db, clock)
+        asyncio.run(sweeper.sweep())
+        assert db.list_pending_secrets("alice", page=1, per_page=1)["total"] == 2
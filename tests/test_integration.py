@@ -5,7 +5,11 @@ Requires Docker — the backend is started via docker-compose (see conftest.py).
 Run with: pytest tests/ -v
 """
 
+import base64
+import json
+import re
 import uuid
+from urllib.parse import unquote
 
 
 # ---------------------------------------------------------------------------
@@ -71,6 +75,99 @@ class TestHealth:
         assert resp.status_code == 200
         assert resp.json() == {"status": "healthy"}
 
+    def test_metrics(self, http_client, crypto_client):
+        view_id, _, _, _ = _create_secret(http_client, crypto_client)
+        http_client.post("/api/view", json={"view": view_id, "uid": "metrics-reader"})
+
+        resp = http_client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = resp.text
+
+        # Requests are labelled with the route template, not the raw path
+        match = re.search(
+            r'^inigma_http_request_duration_seconds_count\{method="POST",route="/api/create",status="200"\} (\d+)$',
+            text, re.M,
+        )
+        assert match and int(match.group(1)) >= 1
+        assert re.search(r'^inigma_db_query_duration_seconds_count\{operation="[a-z_]+"\} \d+$', text, re.M)
+        assert "# TYPE inigma_event_loop_lag_seconds histogram" in text
+        assert re.search(r'^inigma_idempotency_cache_entries \d+$', text, re.M)
+        assert re.search(r'^inigma_expired_messages_deleted_total \d+$', text, re.M)
+
+
+# ---------------------------------------------------------------------------
+# A2. HTML Pages
+# ---------------------------------------------------------------------------
+
+class TestPages:
+    def test_pages_carry_fresh_nonce(self, http_client):
+        """Each page response gets a new CSP nonce; any nonce in the body matches it."""
+        for path in ("/", "/view"):
+            nonces = []
+            for _ in range(2):
+                resp = http_client.get(path)
+                assert resp.status_code == 200
+                assert "__CSP_NONCE__" not in resp.text
+                assert "{{>" not in resp.text
+
+                nonce = re.search(r"'nonce-([^']+)'", resp.headers["content-security-policy"]).group(1)
+                assert set(re.findall(r'nonce="([^"]+)"', resp.text)) <= {nonce}
+                nonces.append(nonce)
+            assert nonces[0] != nonces[1]
+
+    def test_hashed_assets_are_immutable_and_precompressed(self, http_client):
+        """Scripts/styles built into hashed files are cacheable forever and served precompressed."""
+        resp = http_client.get("/")
+        assert resp.status_code == 200
+        urls = re.findall(r'(?:src|href)="(/templates-modular/assets/[^"]+)"', resp.text)
+        assert urls
+
+        for url in urls:
+            plain = http_client.get(url, headers={"Accept-Encoding": "identity"})
+            assert plain.status_code == 200
+            assert "immutable" in plain.headers["cache-control"]
+            assert "content-encoding" not in plain.headers
+
+            gz = http_client.get(url, headers={"Accept-Encoding": "gzip"})
+            assert gz.status_code == 200
+            assert gz.headers["content-encoding"] == "gzip"
+            assert gz.content == plain.content
+
+    def test_page_revalidation_returns_304_with_fresh_nonce(self, http_client):
+        """Built pages embed no nonce, so a 304 is safe and never reuses one."""
+        resp = http_client.get("/")
+        assert resp.status_code == 200
+        assert 'nonce="' not in resp.text
+        etag = resp.headers["etag"]
+        csp = resp.headers["content-security-policy"]
+
+        cached = http_client.get("/", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+        assert cached.headers["content-security-policy"] != csp
+
+        # A nonce smuggled in through If-None-Match is never authorized
+        chosen = "attackerchosennonce0123456789"
+        forged = http_client.get("/", headers={"If-None-Match": f'"{etag.strip(chr(34))}.{chosen}"'})
+        assert forged.status_code == 200
+        assert chosen not in forged.headers["content-security-policy"]
+
+        stale = http_client.get("/", headers={"If-None-Match": '"0000"'})
+        assert stale.status_code == 200
+
+    def test_static_revalidation_returns_304(self, http_client):
+        resp = http_client.get("/templates-modular/scripts/crypto-functions.js")
+        assert resp.status_code == 200
+        etag = resp.headers["etag"]
+        assert not etag.startswith("W/")
+
+        cached = http_client.get(
+            "/templates-modular/scripts/crypto-functions.js", headers={"If-None-Match": etag}
+        )
+        assert cached.status_code == 304
+
 
 # ---------------------------------------------------------------------------
 # B. Create & View (no ownership)
@@ -195,6 +292,75 @@ class TestCreateAndView:
         assert view_id in ids
 
 
+# ---------------------------------------------------------------------------
+# B2. Binary Transfer
+# ---------------------------------------------------------------------------
+
+class TestBinaryTransfer:
+    def _metadata_header(self, crypto_client, iv, salt, ttl=30):
+        creator_uid = crypto_client.generate_uid(crypto_client.generate_symmetric_key())
+        return json.dumps({"iv": iv, "salt": salt, "ttl": ttl, "creator_uid": creator_uid})
+
+    def test_binary_create_and_view(self, http_client, crypto_client):
+        password = crypto_client.generate_symmetric_key()
+        plaintext = "x" * 300_000
+        encrypted, iv, salt = crypto_client.encrypt(plaintext, password)
+
+        resp = http_client.post(
+            "/api/create-binary",
+            content=base64.b64decode(encrypted),
+            headers={
+                "Content-Type": "application/octet-stream",
+                "X-Secret-Metadata": self._metadata_header(crypto_client, iv, salt),
+            },
+        )
+        assert resp.status_code == 200, resp.text
+        view_id = resp.json()["view"]
+
+        data = _view_secret(http_client, view_id).json()
+        assert data["encrypted_message"] == encrypted
+        assert crypto_client.decrypt(data["encrypted_message"], data["iv"], data["salt"], password) == plaintext
+
+    def test_binary_create_rejects_bad_requests(self, http_client, crypto_client):
+        _, iv, salt = crypto_client.encrypt("secret", crypto_client.generate_symmetric_key())
+        metadata = self._metadata_header(crypto_client, iv, salt)
+
+        resp = http_client.post("/api/create-binary", content=b"abc",
+                                headers={"Content-Type": "text/plain", "X-Secret-Metadata": metadata})
+        assert resp.status_code == 415
+
+        resp = http_client.post("/api/create-binary", content=b"abc",
+                                headers={"Content-Type": "application/octet-stream"})
+        assert resp.status_code == 422
+
+        resp = http_client.post("/api/create-binary", content=b"\0" * (2 * 1024 * 1024),
+                                headers={"Content-Type": "application/octet-stream", "X-Secret-Metadata": metadata})
+        assert resp.status_code == 413
+
+    def test_binary_view_streams_ciphertext(self, http_client, crypto_client):
+        view_id, password, _, plaintext = _create_secret(
+            http_client, crypto_client, custom_name="Ключ API", plaintext="y" * 200_000
+        )
+
+        resp = http_client.post("/api/view-binary", json={"view": view_id, "uid": "anonymous"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/octet-stream"
+        assert resp.headers["x-secret-is-owner"] == "false"
+        assert unquote(resp.headers["x-secret-custom-name"]) == "Ключ API"
+        encrypted = base64.b64encode(resp.content).decode()
+        decrypted = crypto_client.decrypt(
+            encrypted, resp.headers["x-secret-iv"], resp.headers["x-secret-salt"], password
+        )
+        assert decrypted == plaintext
+
+        assert _view_secret(http_client, view_id).json()["encrypted_message"] == encrypted
+
+    def test_binary_view_nonexistent(self, http_client):
+        resp = http_client.post("/api/view-binary", json={"view": "doesnotexist123", "uid": "anonymous"})
+        assert resp.status_code == 404
+        assert resp.json()["redirect_root"] == "true"
+
+
 # ---------------------------------------------------------------------------
 # C. Ownership Flow
 # ---------------------------------------------------------------------------
@@ -391,6 +557,43 @@ class TestListAndPagination:
         assert len(data["secrets"]) == 5
 
 
+    def test_cursor_pagination(self, http_client, crypto_client):
+        owner_key = crypto_client.generate_symmetric_key()
+        owner_uid = crypto_client.generate_uid(owner_key)
+        owner_password = crypto_client.generate_symmetric_key()
+
+        claimed = set()
+        for _ in range(7):
+            view_id, _, _, plaintext = _create_secret(http_client, crypto_client)
+            _claim_secret(
+                http_client, crypto_client, view_id, owner_uid, plaintext, owner_password
+            )
+            claimed.add(view_id)
+
+        seen = []
+        cursor = ""
+        while True:
+            resp = http_client.post("/api/list-secrets", json={
+                "uid": owner_uid, "per_page": 3, "cursor": cursor, "include_total": False,
+            })
+            assert resp.status_code == 200
+            data = resp.json()
+            assert "total" not in data
+            seen.extend(s["id"] for s in data["secrets"])
+            if not data["has_more"]:
+                assert data["next_cursor"] is None
+                break
+            cursor = data["next_cursor"]
+
+        assert len(seen) == len(set(seen)) == 7
+        assert set(seen) == claimed
+
+    def test_invalid_cursor_rejected(self, http_client, crypto_client):
+        uid = crypto_client.generate_uid(crypto_client.generate_symmetric_key())
+        resp = http_client.post("/api/list-secrets", json={"uid": uid, "cursor": "!!not-a-cursor!!"})
+        assert resp.status_code == 422
+
+
 # ---------------------------------------------------------------------------
 # E. Delete
 # ---------------------------------------------------------------------------
@@ -0,0 +1,353 @@
+"""
+Migration tests for databases created by older versions.
+
+Each test builds a database the way an older release left it, then runs
+`python -m database migrate` (or DatabaseManager(run_migrations=True)) and
+checks that every secret survives. No Docker needed.
+Run with: pytest tests/test_migrations.py -v
+"""
+
+import asyncio
+import base64
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from database import (
+    PERMANENT_TTL,
+    AsyncDatabaseManager,
+    DatabaseManager,
+    ExpirySweeper,
+    MigrationRequiredError,
+    blob_to_b64,
+    payload_partition,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _message(ttl, encrypted_message="c2VjcmV0"):
+    return {
+        "ttl": ttl,
+        "encrypted_message": encrypted_message,
+        "iv": "AAAAAAAAAAAAAAAA",
+        "salt": "AAAAAAAAAAAAAAAAAAAAAA==",
+        "creator_uid": "alice",
+    }
+
+
+# messages as created by the first release: ciphertext, IV and salt inline as base64 TEXT
+BASELINE_SCHEMA = """
+    CREATE TABLE messages (
+        id TEXT PRIMARY KEY,
+        ttl INTEGER NOT NULL,
+        uid TEXT NOT NULL DEFAULT '',
+        encrypted_message TEXT NOT NULL,
+        iv TEXT NOT NULL,
+        salt TEXT NOT NULL,
+        custom_name TEXT DEFAULT '',
+        creator_uid TEXT DEFAULT '',
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    CREATE INDEX idx_messages_uid ON messages(uid);
+    CREATE INDEX idx_messages_creator_uid ON messages(creator_uid);
+    CREATE INDEX idx_messages_ttl ON messages(ttl);
+    CREATE INDEX idx_messages_uid_ttl_created ON messages(uid, ttl, created_at DESC);
+    CREATE INDEX idx_messages_creator_uid_ttl ON messages(creator_uid, uid, ttl);
+    CREATE INDEX idx_messages_ttl_created_cleanup ON messages(ttl, created_at);
+"""
+
+
+def _baseline_db(path, rows):
+    """A database written by the first release, holding ``rows`` (dicts of column values)"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(BASELINE_SCHEMA)
+    for row in rows:
+        conn.execute(f"INSERT INTO messages ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                     tuple(row.values()))
+    conn.commit()
+    conn.close()
+
+
+def _baseline_rows():
+    now = int(time.time())
+    return [
+        {"id": "expiring", "ttl": now + 3600, "encrypted_message": "c2VjcmV0", "iv": "AAAAAAAAAAAAAAAA",
+         "salt": "AAAAAAAAAAAAAAAAAAAAAA==", "creator_uid": "alice", "created_at": now - 60},
+        {"id": "next-week", "ttl": now + 7 * 86400, "encrypted_message": "bmV4dCB3ZWVr", "iv": "AQEBAQEBAQEBAQEB",
+         "salt": "AgICAgICAgICAgICAgICAg==", "creator_uid": "alice", "created_at": now - 30},
+        {"id": "claimed", "ttl": now + 3600, "uid": "bob", "custom_name": "wifi", "encrypted_message": "Y2xhaW1lZA==",
+         "iv": "AAAAAAAAAAAAAAAA", "salt": "AAAAAAAAAAAAAAAAAAAAAA==", "creator_uid": "alice", "created_at": now - 20},
+        {"id": "permanent", "ttl": PERMANENT_TTL, "encrypted_message": "cGVybWFuZW50", "iv": "AAAAAAAAAAAAAAAA",
+         "salt": "AAAAAAAAAAAAAAAAAAAAAA==", "creator_uid": "carol", "created_at": now - 10},
+        # Not canonical base64 (no padding): must come back exactly as stored
+        {"id": "unpadded", "ttl": now + 3600, "encrypted_message": "dW5wYWRkZWQ", "iv": "AAAAAAAAAAAAAAAA",
+         "salt": "AAAAAAAAAAAAAAAAAAAAAA", "creator_uid": "carol", "created_at": now},
+    ]
+
+
+def _assert_survived(db, rows):
+    for row in rows:
+        message = db.retrieve_message(row["id"])
+        assert message is not None, row["id"]
+        assert blob_to_b64(message["encrypted_message"]) == row["encrypted_message"]
+        assert blob_to_b64(message["iv"]) == row["iv"]
+        assert blob_to_b64(message["salt"]) == row["salt"]
+        for column in ("ttl", "uid", "custom_name", "creator_uid", "created_at"):
+            if column in row:
+                assert message[column] == row[column], (row["id"], column)
+
+
+def _pragma(path, name):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _migrate(path):
+    result = subprocess.run(
+        [sys.executable, "-m", "database", "migrate", "--db", str(path)],
+        cwd=REPO_ROOT, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+# ---------------------------------------------------------------------------
+# auto_vacuum = INCREMENTAL
+# ---------------------------------------------------------------------------
+
+class TestIncrementalVacuum:
+    def _non_incremental_db(self, path):
+        """A current-schema database created before auto_vacuum was switched on"""
+        db = DatabaseManager(path)
+        ttl = int(time.time()) + 3600
+        for i in range(20):
+            assert db.store_message(f"msg-{i}", _message(ttl))
+        assert db.store_message("permanent", _message(PERMANENT_TTL))
+        db.close()
+
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=NONE")
+        conn.execute("VACUUM")
+        conn.close()
+        assert _pragma(path, "auto_vacuum") == 0
+
+    def test_new_database_is_incremental(self, tmp_path):
+        DatabaseManager(tmp_path / "inigma.db").close()
+        assert _pragma(tmp_path / "inigma.db", "auto_vacuum") == 2
+
+    def test_startup_does_not_vacuum_existing_database(self, tmp_path, caplog):
+        path = tmp_path / "inigma.db"
+        self._non_incremental_db(path)
+
+        DatabaseManager(path).close()
+
+        assert _pragma(path, "auto_vacuum") == 0
+        assert "python -m database migrate" in caplog.text
+
+    def test_migrate_converts_existing_database(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        self._non_incremental_db(path)
+
+        _migrate(path)
+        assert _pragma(path, "auto_vacuum") == 2
+
+        db = DatabaseManager(path)
+        for message_id in [f"msg-{i}" for i in range(20)] + ["permanent"]:
+            assert db.retrieve_message(message_id)["encrypted_message"] == b"secret"
+        db.close()
+
+        # A second run has nothing left to do
+        _migrate(path)
+        assert _pragma(path, "auto_vacuum") == 2
+
+
+# ---------------------------------------------------------------------------
+# Inline payloads → message_payloads
+# ---------------------------------------------------------------------------
+
+class TestInlinePayloads:
+    def test_startup_refuses_inline_schema(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        _baseline_db(path, _baseline_rows())
+
+        with pytest.raises(MigrationRequiredError):
+            DatabaseManager(path)
+
+        # Nothing was converted on the way out
+        conn = sqlite3.connect(path)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        assert "encrypted_message" in columns
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == len(_baseline_rows())
+        conn.close()
+
+    def test_migrate_keeps_every_secret(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        rows = _baseline_rows()
+        _baseline_db(path, rows)
+
+        _migrate(path)
+
+        conn = sqlite3.connect(path)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        conn.close()
+        assert "encrypted_message" not in columns
+
+        db = DatabaseManager(path)
+        _assert_survived(db, rows)
+        assert db.list_user_secrets("bob")["total"] == 1
+        assert db.list_pending_secrets("alice")["total"] == 2
+        assert db.list_pending_secrets("carol")["total"] == 2
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# base64 TEXT → BLOB (background, not a migrate step)
+# ---------------------------------------------------------------------------
+
+class TestBase64ToBlob:
+    def _types(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            types = {row[0]: row[1] for row in conn.execute("SELECT id, typeof(encrypted_message) FROM message_payloads")}
+            for table in [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'message_payloads_%'")]:
+                types.update(conn.execute(f"SELECT id, typeof(encrypted_message) FROM {table}").fetchall())
+            salts = dict(conn.execute("SELECT id, typeof(salt) FROM messages").fetchall())
+            sizes = dict(conn.execute("SELECT id, payload_size FROM messages").fetchall())
+            return types, salts, sizes
+        finally:
+            conn.close()
+
+    def test_startup_leaves_text_rows_and_serves_them(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        rows = _baseline_rows()
+        _baseline_db(path, rows)
+        _migrate(path)
+
+        db = DatabaseManager(path)
+        types, salts, _ = self._types(path)
+        assert set(types.values()) == {"text"}
+        assert set(salts.values()) == {"text"}
+        _assert_survived(db, rows)
+        db.close()
+
+    def test_binary_view_leaves_text_payloads_to_json_view(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        rows = _baseline_rows()
+        _baseline_db(path, rows)
+        _migrate(path)
+
+        db = DatabaseManager(path)
+        async_db = AsyncDatabaseManager(db)
+        metadata = db.retrieve_message_metadata("unpadded")
+        assert metadata["encrypted_message"] == "dW5wYWRkZWQ"
+
+        # Neither from disk nor from the cache is a TEXT payload streamed
+        for _ in range(2):
+            message, chunks = asyncio.run(async_db.open_message_stream("unpadded"))
+            assert chunks is None
+            assert message["encrypted_message"] == "dW5wYWRkZWQ"
+            assert blob_to_b64(message["salt"]) == "AAAAAAAAAAAAAAAAAAAAAA"
+            db.retrieve_message("unpadded")
+        async_db.close()
+
+    def test_sweeper_converts_canonical_rows_only(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        rows = _baseline_rows()
+        _baseline_db(path, rows)
+        _migrate(path)
+
+        db = DatabaseManager(path)
+        async_db = AsyncDatabaseManager(db)
+        sweeper = ExpirySweeper(async_db)
+        asyncio.run(sweeper.sweep())
+        async_db.close()
+
+        assert not db.legacy_base64_pending()
+        types, salts, sizes = self._types(path)
+        assert types.pop("unpadded") == "text"
+        assert salts.pop("unpadded") == "text"
+        assert set(types.values()) == {"blob"}
+        assert set(salts.values()) == {"blob"}
+        assert sizes["expiring"] == len(b"secret")
+        # Every messages row (the unpadded one's IV is canonical) and every payload but one
+        assert sweeper.stats()["legacy_rows_converted_total"] == 2 * len(rows) - 1
+
+        reopened = DatabaseManager(path)
+        _assert_survived(reopened, rows)
+        reopened.close()
+
+    def test_conversion_resumes_across_small_batches(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        rows = _baseline_rows()
+        _baseline_db(path, rows)
+        _migrate(path)
+
+        db = DatabaseManager(path)
+        converted = []
+        while db.legacy_base64_pending():
+            converted.append(db.convert_legacy_base64(limit=2))
+        assert sum(converted) == 2 * len(rows) - 1
+        assert max(converted) <= 2
+        # Nothing is scanned again once every table is done
+        assert db.convert_legacy_base64(limit=2) == 0
+        _assert_survived(db, rows)
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# message_payloads → per-day partitions
+# ---------------------------------------------------------------------------
+
+class TestPayloadPartitions:
+    def _unpartitioned_db(self, path, rows):
+        """Current schema, but every payload in message_payloads (as before partitioning)"""
+        DatabaseManager(path).close()
+        conn = sqlite3.connect(path)
+        for row in rows:
+            conn.execute(
+                "INSERT INTO messages (id, ttl, iv, salt, creator_uid, created_at, payload_size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row["id"], row["ttl"], base64.b64decode(row["iv"]), base64.b64decode(row["salt"]),
+                 row["creator_uid"], row["created_at"], len(base64.b64decode(row["encrypted_message"]))),
+            )
+            conn.execute("INSERT INTO message_payloads (id, encrypted_message) VALUES (?, ?)",
+                         (row["id"], base64.b64decode(row["encrypted_message"])))
+        conn.commit()
+        conn.close()
+
+    def _rows(self):
+        return [row for row in _baseline_rows() if row["id"] != "unpadded" and "uid" not in row]
+
+    def test_startup_refuses_unpartitioned_payloads(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        self._unpartitioned_db(path, self._rows())
+
+        with pytest.raises(MigrationRequiredError):
+            DatabaseManager(path)
+
+    def test_migrate_moves_payloads_into_day_partitions(self, tmp_path):
+        path = tmp_path / "inigma.db"
+        rows = self._rows()
+        self._unpartitioned_db(path, rows)
+
+        _migrate(path)
+
+        conn = sqlite3.connect(path)
+        remaining = [row[0] for row in conn.execute("SELECT id FROM message_payloads")]
+        conn.close()
+        assert remaining == ["permanent"]
+
+        db = DatabaseManager(path)
+        expected = {payload_partition(row["ttl"]) for row in rows if row["ttl"] != PERMANENT_TTL}
+        assert db._partitions == expected
+        _assert_survived(db, rows)
+        db.close()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Field types and validation shared by the request models.
+
+Identifiers, IV and salt are annotated types whose pattern and length
+constraints are checked inside pydantic-core, so no Python code runs for
+them per request. The ciphertext is checked and decoded in one native pass
+(binascii strict mode) rather than scanned by a regex and decoded again
+later; its validator returns the decoded bytes, which go straight to
+storage.
+"""
+import binascii
+from typing import Annotated, Union
+
+from pydantic import StringConstraints
+
+MAX_ENCRYPTED_MESSAGE_SIZE = 2 * 1024 * 1024  # 2MB of base64 text
+MAX_IV_LENGTH = 64
+MAX_SALT_LENGTH = 128
+
+# Canonical padded base64, the same text binascii strict mode accepts
+BASE64_PATTERN = r'^(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?$'
+
+MessageId = Annotated[str, StringConstraints(pattern=r'^[a-zA-Z0-9_-]{1,50}$')]
+Uid = Annotated[str, StringConstraints(pattern=r'^[a-zA-Z0-9_-]{1,128}$')]
+IdempotencyKey = Annotated[str, StringConstraints(pattern=r'^[a-zA-Z0-9_-]{1,64}$')]
+# IV and salt stay base64 text after validation; b64_to_blob decodes them
+Base64IV = Annotated[str, StringConstraints(min_length=1, max_length=MAX_IV_LENGTH, pattern=BASE64_PATTERN)]
+Base64Salt = Annotated[str, StringConstraints(min_length=1, max_length=MAX_SALT_LENGTH, pattern=BASE64_PATTERN)]
+
+
+def decode_base64(value: str) -> Union[bytes, str]:
+    """Decode base64 text, raising ValueError unless it is strictly valid.
+
+    Rejects characters outside the standard alphabet, missing or misplaced
+    padding and data after the padding. Valid text that is not canonical
+    (non-zero spare bits in the final group) is returned unchanged so it
+    can be stored and served back verbatim; otherwise the raw bytes are
+    returned.
+    """
+    try:
+        raw = binascii.a2b_base64(value, strict_mode=True)
+    except ValueError as e:  # binascii.Error, or non-ASCII text
+        raise ValueError('Invalid base64 format') from e
+    # Full 4-char groups map 1:1 to bytes; only a padded final group can
+    # carry non-zero spare bits, so re-encoding it is enough to check.
+    tail = len(raw) % 3
+    if tail and binascii.b2a_base64(raw[-tail:], newline=False).decode("ascii") != value[-4:]:
+        return value
+    return raw
+
+
+def validate_ciphertext(value: str) -> Union[bytes, str]:
+    """Check an encrypted_message field; returns it decoded (see decode_base64)"""
+    if not value:
+        raise ValueError('Encrypted message cannot be empty')
+    if len(value) > MAX_ENCRYPTED_MESSAGE_SIZE:
+        raise ValueError('Encrypted message too large (max 2MB)')
+    return decode_base64(value)
+